@@ -1,9 +1,6 @@
 #! /usr/bin/env python
 
 
-import scipy.constants
-
-
 #####################################################################
 # Orders of magnitude
 #####################################################################
@@ -22,6 +19,7 @@ Pi = 3.1415927
 boltzmannsConstant = 1.3810000000000000e-23 # J/K
 plancksConstant = 6.6260680000000000e-34 # J s
 speedOfLight = 2.9979245800000000e+08 # m/s
+gravitationalConstant = 6.6743000000000000e-11 # m^3/kg/s^2
 
 #####################################################################
 # LENGTH 
@@ -31,6 +29,11 @@ angstrom = 1.0000000000000000e-10 # m
 Parsec = 3.0856775800000000e+16 # m
 megaParsec = 3.0856775800000000e+22 # m
 
+#####################################################################
+# TIME
+#####################################################################
+year = 3.1536000000000000e+07 # s (365 days)
+
 #####################################################################
 # MASS
 #####################################################################
@@ -1,11 +1,170 @@
 #! /usr/bin/env python
 
-import sys,fnmatch
+import sys,os,fnmatch,glob,hashlib,io,json
+from collections import OrderedDict
 import numpy as np
-import scipy as sp
-from scipy.constants import c,constants
-from scipy.integrate import romberg
+from . import constants
 from .constants import Pi,massSolar,Parsec
+# scipy is imported inside the functions that need it, which keeps
+# 'import aimpy.cosmology' cheap for short-lived scripts.
+c = constants.speedOfLight
+
+
+_NUMEXPR = None
+
+def _numexpr():
+    """
+    _numexpr(): Return the numexpr module, or None if it is not installed.
+                (It is only imported when first needed.)
+    """
+    global _NUMEXPR
+    if _NUMEXPR is None:
+        try:
+            import numexpr
+            _NUMEXPR = numexpr
+        except ImportError:
+            _NUMEXPR = False
+    return _NUMEXPR or None
+
+
+def cumulativeQuadrature(func,x,order=8):
+    """
+    cumulativeQuadrature(): Returns the cumulative integral of func from
+                            x[0] to each of the nodes in x.
+
+    USAGE: I = cumulativeQuadrature(func,x,[order])
+
+          func  -- vectorized integrand, called once with a 2-D array of
+                   abscissae of shape (len(x)-1,order).
+          x     -- monotonic array of integration nodes.
+          order -- number of Gauss-Legendre points per cell (default = 8).
+
+    Note: each cell [x[i],x[i+1]] is integrated with an order-point
+          Gauss-Legendre rule, so the error per cell scales as
+          dx**(2*order+1).
+
+    """
+    x = np.asarray(x,dtype=float)
+    cells = cellQuadrature(func,x[:-1],x[1:],order=order)
+    result = np.zeros(len(x))
+    np.cumsum(cells,out=result[1:])
+    return result
+
+
+def cellQuadrature(func,lower,upper,order=8):
+    """
+    cellQuadrature(): Returns the integrals of func over each of the
+                      intervals [lower[i],upper[i]] using an order-point
+                      Gauss-Legendre rule.
+
+    USAGE: I = cellQuadrature(func,lower,upper,[order])
+
+    """
+    nodes,weights = np.polynomial.legendre.leggauss(order)
+    lower = np.asarray(lower,dtype=float)[...,np.newaxis]
+    halfWidth = 0.5*(np.asarray(upper,dtype=float)[...,np.newaxis]-lower)
+    abscissae = lower + halfWidth*(nodes+1.0)
+    return np.sum(func(abscissae)*weights,axis=-1)*halfWidth[...,0]
+
+class DistanceTableCache(object):
+    """
+    DistanceTableCache: class to store the redshift tables built by
+                        Cosmology so that they are only computed once for
+                        each set of cosmological parameters.
+
+          USAGE: CACHE = DistanceTableCache([maxsize],[cachedir])
+
+          INPUTS
+              maxsize -- Maximum number of parameter sets held in memory.
+                         Least recently used entries are discarded first.
+                         (Default = 32).
+             cachedir -- Directory in which to store tables (one .npz file
+                         per parameter set) so that they persist between
+                         runs. If None, tables are only cached in memory.
+                         (Default = None).
+
+    Tables are dictionaries of numpy arrays, keyed on a tuple of the
+    parameters that determine them. Cached arrays are marked read-only as
+    they are shared between Cosmology instances.
+
+    """
+    # Prefix of the names of the files written to cachedir
+    fileprefix = "aimpyDistanceTables_"
+
+    def __init__(self,maxsize=32,cachedir=None):
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self._tables = OrderedDict()
+        return
+
+    def __len__(self):
+        return len(self._tables)
+
+    def _filename(self,key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cachedir,self.fileprefix+digest+".npz")
+
+    def get(self,key):
+        """
+        DistanceTableCache.get(): Return dictionary of tables for specified
+                                  key, or None if not cached.
+        """
+        if key in self._tables:
+            self._tables.move_to_end(key)
+            return self._tables[key]
+        if self.cachedir is None:
+            return None
+        path = self._filename(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            tables = {name:data[name] for name in data.files}
+        self._store(key,tables)
+        return tables
+
+    def put(self,key,tables):
+        """
+        DistanceTableCache.put(): Store dictionary of tables under specified
+                                  key (and write to disk if cachedir is set).
+
+        Note: all of the tables are written to a temporary file that is then
+              renamed, so other processes never see a partial set of tables.
+        """
+        self._store(key,tables)
+        if self.cachedir is not None:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            path = self._filename(key)
+            tmp = path+"."+str(os.getpid())+".tmp"
+            with open(tmp,"wb") as f:
+                np.savez(f,**tables)
+            os.replace(tmp,path)
+        return
+
+    def _store(self,key,tables):
+        for arr in tables.values():
+            arr.setflags(write=False)
+        self._tables[key] = tables
+        self._tables.move_to_end(key)
+        while len(self._tables) > max(self.maxsize,0):
+            self._tables.popitem(last=False)
+        return
+
+    def clear(self,disk=False):
+        """
+        DistanceTableCache.clear(): Empty the in-memory cache (and remove
+                                    tables on disk if disk=True).
+        """
+        self._tables.clear()
+        if disk and self.cachedir is not None:
+            for f in glob.glob(os.path.join(self.cachedir,self.fileprefix+"*.npz")):
+                os.remove(f)
+        return
+
+
+# Process-wide cache shared by all Cosmology instances
+tableCache = DistanceTableCache()
+
 
 class Cosmology(object):
     """
@@ -32,19 +191,48 @@ class Cosmology(object):
                        within a sphere extending out to redshift,
                        z
     dVdz() :  calculates dV/dz at redshift, z
+    redshift_at_volume() : calculates the redshift at which the comoving
+                           volume is V
+    random_redshifts() : draws redshifts uniformly in comoving volume
+    growth_factor() : calculates the linear growth factor, D(z)
+    growth_rate() : calculates the linear growth rate, f(z)
+    overdensity(), virial_radius(), virial_mass(), circular_velocity(),
+    halo_catalog() : halo properties for a given halo definition
+    realspace() : converts sky coordinates and redshifts to Cartesian
+                  comoving positions
+    skyspace() : converts Cartesian comoving positions to sky coordinates
+                 and redshifts
+    (see also the module function redshiftSpace() for applying peculiar
+     velocities to realspace() positions)
+    distances() : calculates transverse comoving, angular diameter and
+                  luminosity distances and band corrected distance
+                  modulus at redshift, z, in a single pass
     H() : return Hubble constant as measured at redshift, z
     E() : returns Peebles' E(z) function at redshift, z, for
           specified cosmology
 
-    NOTE: this module requires the numpy and scipy libraries.
+    Redshift tables are extended on demand when a redshift (or distance)
+    beyond zmax is requested. Cosmology.zlimit sets the largest redshift
+    to which tables will be extended when inverting distances.
+
+    NOTE: this module requires the numpy and scipy libraries. E(z) uses
+          numexpr for large arrays if it is installed.
 
     Based upon the 'Cosmology Calculator' (Wright, 2006, PASP,
     118, 1711) and Fortran 90 code written by John Helly.
     
     """
+
+    zlimit = 1100.0
+    # Minimum array size for which E(z) is evaluated with numexpr
+    numexpr_threshold = 65536
+    # Cumulative tables integrated on the redshift grid
+    _tables = ["r_comoving","t_lookback"]
     
     def __init__(self,omega0=0.25,lambda0=0.75,omegab=0.045,h0=0.73,sigma8=0.9,ns=1.0,\
-                     radiation=False,zmax=20.0,nzmax=10000,h_independent=True):
+                     radiation=False,zmax=20.0,nzmax=10000,h_independent=True,\
+                     integrator="gauss",cache=True,grid="uniform",rtol=1.0e-6,\
+                     out_of_range="extend",backend="auto"):
         classname = self.__class__.__name__
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
 
@@ -78,7 +266,7 @@ class Cosmology(object):
         self.HubbleVolume = self.HubbleDistance**3
 
         # Compute critical density
-        self.criticalDensity = (3.0*(100**2)/8.0/Pi/constants.G)
+        self.criticalDensity = (3.0*(100**2)/8.0/Pi/constants.gravitationalConstant)
         self.criticalDensity *=(constants.kilo/self.Mpc)**2
         self.criticalDensity /= massSolar/(self.Mpc**3)
 
@@ -91,9 +279,235 @@ class Cosmology(object):
         self._redshift = np.arange(0.0,self._zmax,self._dz)
         self._inv_dz = 1.0/self._dz
         self._initialize_redshift_array = True
+        if integrator not in ["gauss","romberg"]:
+            raise ValueError(funcname+"(): integrator must be one of 'gauss' or 'romberg'!")
+        self.integrator = integrator
+        self.cache = cache
+        # Select type of redshift grid. The 'adaptive' grid places nodes in
+        # log(1+z) until monotone cubic interpolation of the comoving distance
+        # reaches a relative accuracy of rtol (nzmax is then ignored).
+        if grid not in ["uniform","adaptive"]:
+            raise ValueError(funcname+"(): grid must be one of 'uniform' or 'adaptive'!")
+        self.grid = grid
+        self.rtol = rtol
+        self._interpolators = {}
+        self._inverse_redshift = None
+        self._age0 = None
+        self._shared_memory = None
+        self._shared_owner = False
+        self._derived = {}
+        # Select how to treat redshifts/distances outside of the tables:
+        # 'extend' the tables, 'raise' a ValueError, 'clip' to the table
+        # limits or return 'nan'. (Negative values are clipped to zero
+        # when extending.)
+        if out_of_range not in ["extend","raise","clip","nan"]:
+            raise ValueError(funcname+"(): out_of_range must be one of 'extend', 'raise', "+\
+                                 "'clip' or 'nan'!")
+        self.out_of_range = out_of_range
+        # Select backend for distances: flat models without radiation have
+        # closed-form comoving distances, so no table is needed. The 'auto'
+        # backend uses the 'analytic' backend whenever possible and the
+        # 'table' backend otherwise. (For very large arrays the 'table'
+        # backend is faster, at the accuracy of the interpolation.)
+        analytic = np.fabs(self.omegak) < 1.0e-9 and self.omegar == 0.0 and \
+            self.lambda0 >= 0.0
+        if backend == "auto":
+            backend = "analytic" if analytic else "table"
+        if backend not in ["analytic","table"]:
+            raise ValueError(funcname+"(): backend must be one of 'auto', 'analytic' or 'table'!")
+        if backend == "analytic" and not analytic:
+            raise ValueError(funcname+"(): 'analytic' backend requires a flat cosmology "+\
+                                 "without radiation!")
+        self.backend = backend
+
+        return
+
 
+    def __getstate__(self):
+        """
+        Build the redshift tables (with the 'table' backend) before
+        pickling so that unpickled copies (e.g. in multiprocessing workers
+        or MPI ranks) do not rebuild them. Tables that have not been built
+        (e.g. with the 'analytic' backend), interpolators, the inverse
+        redshift table and shared memory handles are not pickled.
+        """
+        if self._initialize_redshift_array and self.backend == "table":
+            self._init_redshift_array()
+        state = self.__dict__.copy()
+        state["_interpolators"] = {}
+        state["_shared_memory"] = None
+        state["_shared_owner"] = False
+        state["_derived"] = {}
+        state["_inverse_redshift"] = None
+        if self._initialize_redshift_array:
+            state["_redshift"] = None
+            state["_r_comoving"] = None
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if self._redshift is None:
+            self._redshift = np.arange(0.0,self._zmax,self._dz)
+            self._r_comoving = np.zeros(self._nzmax)
         return
 
+    def _parameter_state(self):
+        """
+        _parameter_state(): Returns dictionary of the scalar attributes
+                            (parameters and derived constants) of this
+                            instance.
+        """
+        scalars = (bool,int,float,str,type(None))
+        return {key:value for key,value in self.__dict__.items() \
+                    if isinstance(value,scalars) and key not in ["_age0","_shared_owner"]}
+
+    def serialize(self,dtype=np.float64):
+        """
+        serialize(): Returns a compact serialized form (bytes) of this
+                     instance, containing its parameters and redshift
+                     tables.
+
+        USAGE: blob = serialize([dtype])
+
+               dtype -- Data type used to store the tables, e.g. np.float32
+                        to halve the size. (Default = np.float64).
+
+        """
+        if self._initialize_redshift_array:
+            self._init_redshift_array()
+        arrays = {name:getattr(self,"_"+name).astype(dtype) for name in self._tables}
+        arrays["redshift"] = self._redshift.astype(dtype)
+        state = {"class":self.__class__.__name__,"parameters":self._parameter_state()}
+        buffer = io.BytesIO()
+        np.savez(buffer,state=np.array(json.dumps(state)),**arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def deserialize(cls,blob):
+        """
+        deserialize(): Returns a new instance from the output of
+                       serialize(). Tables are converted back to float64.
+
+        USAGE: COSMO = Cosmology.deserialize(blob)
+
+        """
+        funcname = cls.__name__+"."+sys._getframe().f_code.co_name
+        data = np.load(io.BytesIO(blob))
+        state = json.loads(str(data["state"]))
+        # Create an instance of the class that was serialized, which must
+        # be cls or one of its subclasses
+        classes = [cls]
+        for klass in classes:
+            classes.extend(klass.__subclasses__())
+        classes = [klass for klass in classes if klass.__name__ == state["class"]]
+        if len(classes) == 0:
+            raise ValueError(funcname+"(): serialized instance of '"+state["class"]+\
+                                 "' cannot be deserialized as "+cls.__name__+"!")
+        obj = classes[0].__new__(classes[0])
+        obj.__dict__.update(state["parameters"])
+        obj._interpolators = {}
+        obj._inverse_redshift = None
+        obj._age0 = None
+        obj._shared_memory = None
+        obj._shared_owner = False
+        obj._derived = {}
+        obj._redshift = data["redshift"].astype(float)
+        for name in obj._tables:
+            setattr(obj,"_"+name,data[name].astype(float))
+        obj._initialize_redshift_array = False
+        return obj
+
+    def share_tables(self):
+        """
+        share_tables(): Copy the redshift tables into shared memory and
+                        return a (picklable) handle from which other
+                        processes on the same node can map them.
+
+        USAGE: handle = share_tables()
+
+               COSMO = Cosmology.from_shared_tables(handle)
+
+        Note: this instance owns the shared memory blocks, which are
+              released by release_shared_tables(). Workers should not
+              outlive the owner. Calling share_tables() on an instance
+              created by from_shared_tables() returns a handle to the
+              same blocks.
+        """
+        from multiprocessing import shared_memory
+        if self._shared_memory is not None and not self._shared_owner:
+            tables = {}
+            for name,shm in zip(["redshift"]+self._tables,self._shared_memory):
+                arr = getattr(self,"_"+name)
+                tables[name] = (shm.name,arr.shape,arr.dtype.str)
+            return {"class":self.__class__,"parameters":self._parameter_state(),\
+                        "tables":tables}
+        if self._initialize_redshift_array:
+            self._init_redshift_array()
+        self.release_shared_tables()
+        self._shared_memory = []
+        self._shared_owner = True
+        tables = {}
+        for name in ["redshift"]+self._tables:
+            arr = getattr(self,"_"+name)
+            shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+            shared = np.ndarray(arr.shape,dtype=arr.dtype,buffer=shm.buf)
+            shared[:] = arr
+            self._shared_memory.append(shm)
+            tables[name] = (shm.name,arr.shape,arr.dtype.str)
+        return {"class":self.__class__,"parameters":self._parameter_state(),\
+                    "tables":tables}
+
+    @classmethod
+    def from_shared_tables(cls,handle):
+        """
+        from_shared_tables(): Returns a new instance whose redshift tables
+                              are read-only views of the shared memory
+                              described by handle (see share_tables()).
+
+        USAGE: COSMO = Cosmology.from_shared_tables(handle)
+
+        """
+        from multiprocessing import shared_memory
+        obj = handle["class"].__new__(handle["class"])
+        obj.__dict__.update(handle["parameters"])
+        obj._interpolators = {}
+        obj._inverse_redshift = None
+        obj._age0 = None
+        obj._shared_memory = []
+        obj._shared_owner = False
+        obj._derived = {}
+        for name in ["redshift"]+obj._tables:
+            shmname,shape,dtype = handle["tables"][name]
+            shm = shared_memory.SharedMemory(name=shmname)
+            arr = np.ndarray(shape,dtype=np.dtype(dtype),buffer=shm.buf)
+            arr.setflags(write=False)
+            setattr(obj,"_"+name,arr)
+            obj._shared_memory.append(shm)
+        obj._initialize_redshift_array = False
+        return obj
+
+    def release_shared_tables(self):
+        """
+        release_shared_tables(): Release shared memory created by
+                                 share_tables().
+
+        Note: only the instance that created the blocks unlinks them. An
+              instance created by from_shared_tables() copies its tables
+              out of the shared memory and then unmaps it.
+        """
+        if self._shared_memory is None:
+            return
+        if not self._shared_owner:
+            for name in ["redshift"]+self._tables:
+                setattr(self,"_"+name,np.array(getattr(self,"_"+name)))
+            self._interpolators = {}
+            self._inverse_redshift = None
+        for shm in self._shared_memory:
+            shm.close()
+            if self._shared_owner:
+                shm.unlink()
+        self._shared_memory = None
+        return
 
     def report_parameters(self):
         report = "\nCOSMOLOGY:\n" + \
@@ -110,77 +524,677 @@ class Cosmology(object):
         return
     
 
-    def E(self,z=0.0):
+    def E(self,z=0.0,out=None,dtype=None):
         """
         E(z): Peebles' E(z) function.
-        
-        """
-        a = 1.0/(1.0+z)
-        result = self.omegak*(a**-2) + self.lambda0 + \
-                 self.omega0*(a**-3) + self.omegar*(a**-4)
-        return np.sqrt(result)
 
+        USAGE: E(z,[out],[dtype])
+
+              out   -- Preallocated array in which to store the result.
+                       (Default = None, allocate a new array).
+              dtype -- Precision of the calculation, e.g. np.float32.
+                       (Default = None, use the dtype of out, or float64).
 
-    def H(self,z=0.0):
+        Note: E(z)**2 is evaluated as a polynomial in x = 1+z by Horner's
+              scheme, lambda0 + x**2*(omegak + x*(omega0 + x*omegar)),
+              in place in the output array. Arrays with at least
+              numexpr_threshold elements are evaluated with numexpr (which
+              is multithreaded) when it is installed.
+        
+        """
+        if dtype is None:
+            dtype = np.float64 if out is None else out.dtype
+        x = np.add(z,1.0,dtype=dtype)
+        result = np.empty_like(x) if out is None else out
+        numexpr = _numexpr() if x.size >= self.numexpr_threshold else None
+        if numexpr is not None:
+            coefficients = dict([(name,x.dtype.type(getattr(self,name))) for name in \
+                                     ["lambda0","omegak","omega0","omegar"]])
+            coefficients["x"] = x
+            numexpr.evaluate("sqrt(lambda0+x*x*(omegak+x*(omega0+x*omegar)))",\
+                                 local_dict=coefficients,out=result,casting="same_kind")
+        else:
+            np.multiply(x,self.omegar,out=result)
+            result += self.omega0
+            result *= x
+            result += self.omegak
+            result *= x
+            result *= x
+            result += self.lambda0
+            np.sqrt(result,out=result)
+        if out is None:
+            return result[()]
+        return out
+
+
+    def H(self,z=0.0,out=None,dtype=None):
         """
         H(z): Function to return the Hubble parameter as measured
               by an observer at redshift, z.
+
+        USAGE: H(z,[out],[dtype]) (see E(z))
         """
-        result = self.H0*self.E(z)
-        return result
+        result = np.multiply(self.E(z,out=out,dtype=dtype),self.H0,out=out)
+        return result if out is not None else result[()]
 
     
-    def f(self,z=0.0):
+    def f(self,z=0.0,out=None,dtype=None):
         """
         f(z): Function relating comoving distance to redshift.
               Integrating f(z)dz from 0 to z' gives comoving
               distance r(z'). Result is in Mpc/h.
+
+        USAGE: f(z,[out],[dtype]) (see E(z))
         
         Note: uses global cosmology variables.          
         """
-        a = 1.0/(1.0+z)
-        result = self.omegak*(a**-2) + self.lambda0 + \
-                 self.omega0*(a**-3) + self.omegar*(a**-4)
-        result = (c/self.H0SI)/np.sqrt(result)/self.Mpc
-        return result
+        result = np.divide(self.HubbleDistance,self.E(z,out=out,dtype=dtype),out=out)
+        return result if out is not None else result[()]
 
 
     def _init_redshift_array(self):
-        for i in range(1,len(self._redshift)):
-            z1 = self._redshift[i-1]
-            z2 = self._redshift[i]
-            self._r_comoving[i] = self._r_comoving[i-1] + \
-                                  romberg(self.f,z1,z2)
+        """
+        _init_redshift_array(): Build the tables of comoving distance and
+                                lookback time vs. redshift used for
+                                interpolation.
+
+        Note: the default 'gauss' integrator evaluates f(z) for the whole
+              redshift grid in a single call using an 8-point Gauss-Legendre
+              rule per cell. For the default grid (dz=0.002) this agrees
+              with the 'romberg' integrator to better than 1 part in 10^10.
+              The 'adaptive' grid always uses the 'gauss' integrator.
+        """
+        if self.cache:
+            tables = tableCache.get(self._table_key())
+            if tables is not None and all([name in tables for name in ["redshift"]+self._tables]):
+                self._redshift = tables["redshift"]
+                for name in self._tables:
+                    setattr(self,"_"+name,tables[name])
+                self._initialize_redshift_array = False
+                return
+        if self.grid == "adaptive":
+            x,self._r_comoving = self._adaptive_redshift_array()
+            self._redshift = np.expm1(x)
+        else:
+            self._r_comoving = self._integrate_redshift_array(self._redshift)
+        self._t_lookback = cumulativeQuadrature(self._dt_dz,self._redshift)
+        if self.cache:
+            tables = {name:getattr(self,"_"+name) for name in self._tables}
+            tables["redshift"] = self._redshift
+            tableCache.put(self._table_key(),tables)
         self._initialize_redshift_array = False
         return
 
+    def _table_key(self):
+        """
+        _table_key(): Returns tuple of the parameters that determine the
+                      redshift tables (used as key for tableCache).
+        """
+        if self.grid == "adaptive":
+            return (self.omega0,self.lambda0,self.omegar,float(self.H0),\
+                        self._zmax,self.grid,self.rtol)
+        return (self.omega0,self.lambda0,self.omegar,float(self.H0),\
+                    self._zmax,self._nzmax,self.integrator)
+
+    def _dt_dz(self,z):
+        """
+        _dt_dz(): Integrand for lookback time (in Gyr) with respect to
+                  redshift, i.e. 1/((1+z)H(z)).
+        """
+        return self.HubbleTime/((1.0+z)*self.E(z))
+
+    def _dr_dlna(self,x):
+        """
+        _dr_dlna(): Integrand for comoving distance with respect to
+                    x = log(1+z), i.e. (1+z)*f(z).
+        """
+        return self.f(np.expm1(x))*np.exp(x)
+
+    def _adaptive_redshift_array(self,x0=0.0,x1=None,r0=0.0,nstart=64,maxnodes=2**20):
+        """
+        _adaptive_redshift_array(): Build a table of comoving distance on a
+                                    grid in x = log(1+z), bisecting cells
+                                    until monotone cubic interpolation at
+                                    the cell midpoints is accurate to rtol.
+
+        USAGE: x,r = _adaptive_redshift_array([x0],[x1],[r0],[nstart])
+
+               Integrates from x0 (where comoving distance is r0) to x1
+               (default log(1+zmax)) starting from nstart equal cells.
+        """
+        from scipy.interpolate import PchipInterpolator
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        if x1 is None:
+            x1 = np.log1p(self._zmax)
+        x = np.linspace(x0,x1,nstart+1)
+        while True:
+            r = r0 + cumulativeQuadrature(self._dr_dlna,x)
+            xmid = 0.5*(x[1:]+x[:-1])
+            rmid = r[:-1] + cellQuadrature(self._dr_dlna,x[:-1],xmid)
+            # Midpoint errors underestimate the maximum error within a cell
+            # so refine to a quarter of the requested tolerance
+            error = np.fabs(PchipInterpolator(x,r)(xmid)-rmid)/rmid
+            refine = error > 0.25*self.rtol
+            if not np.any(refine):
+                break
+            if len(x)+np.count_nonzero(refine) > maxnodes:
+                raise RuntimeError(funcname+"(): unable to reach rtol="+str(self.rtol)+\
+                                       " with fewer than "+str(maxnodes)+" nodes!")
+            x = np.sort(np.append(x,xmid[refine]))
+        return x,r
+
+    def _table(self,name):
+        """
+        _table(): Returns the named table on the redshift grid. Tables
+                  that are not integrated directly (see self._tables)
+                  are built on first use by the _build_<name>() method.
+        """
+        if name in self._tables:
+            return getattr(self,"_"+name)
+        if name not in self._derived:
+            self._derived[name] = getattr(self,"_build_"+name)()
+        return self._derived[name]
+
+    def _build_v_comoving_cbrt(self):
+        """
+        _build_v_comoving_cbrt(): Table of cube root of comoving volume.
+        (The cube root varies almost linearly with redshift, so it is
+        interpolated far more accurately than the volume itself.)
+        """
+        DM = self._transverse_from_comoving(self._r_comoving)
+        return np.cbrt(self._volume_from_transverse(DM))
+
+    def _build_dvdz_sqrt(self):
+        """
+        _build_dvdz_sqrt(): Table of square root of dV/dz.
+        """
+        DM = self._transverse_from_comoving(self._r_comoving)
+        return np.sqrt(4.0*Pi*self.HubbleDistance/self.E(self._redshift))*DM
+
+    def _build_growth_factor(self):
+        """
+        _build_growth_factor(): Tables of linear growth factor, D(z), and
+        growth rate, f(z) = dlnD/dlna, found by solving
+
+            D'' + (2 + dlnE/dlna)D' - 1.5*omega0*D/(a**3*E**2) = 0
+
+        (primes are d/dlna) once for the whole redshift grid. The
+        integration starts deep in the radiation/matter era from the
+        growing mode D = a/a_eq + 2/3 (Meszaros 1974; D = a without
+        radiation). D is normalised so that D(0) = 1.
+        """
+        from scipy.integrate import solve_ivp
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        if self.omega0 <= 0.0:
+            raise ValueError(funcname+"(): growth factor requires omega0 > 0!")
+        def E2(a):
+            return self.omegak*(a**-2) + self.lambda0 + \
+                self.omega0*(a**-3) + self.omegar*(a**-4)
+        def dlnE2_dlna(a):
+            return -(2.0*self.omegak*(a**-2) + 3.0*self.omega0*(a**-3) + \
+                         4.0*self.omegar*(a**-4))/E2(a)
+        def derivatives(lna,y):
+            a = np.exp(lna)
+            D,dD = y
+            ddD = -(2.0+0.5*dlnE2_dlna(a))*dD + 1.5*self.omega0*D/(a**3*E2(a))
+            return [dD,ddD]
+        a0 = min(1.0e-5,0.01/(1.0+self._redshift[-1]))
+        aeq = self.omegar/self.omega0
+        if aeq > 0.0:
+            y0 = [a0/aeq+2.0/3.0,a0/aeq]
+        else:
+            y0 = [a0,a0]
+        lna = -np.log1p(self._redshift)
+        solution = solve_ivp(derivatives,(np.log(a0),0.0),y0,method="DOP853",\
+                                 dense_output=True,rtol=1.0e-11,atol=1.0e-30)
+        D,dD = solution.sol(lna)
+        D0 = solution.sol(0.0)[0]
+        self._derived["growth_rate"] = dD/D
+        return D/D0
+
+    def _build_growth_rate(self):
+        """
+        _build_growth_rate(): Table of growth rate (see _build_growth_factor).
+        """
+        self._table("growth_factor")
+        return self._derived["growth_rate"]
+
+    def _adaptive_interpolator(self,name,inverse=False):
+        """
+        _adaptive_interpolator(): Return monotone cubic interpolator for
+                                  the named table as a function of
+                                  log(1+z) (or its inverse) on the
+                                  adaptive grid.
+        """
+        from scipy.interpolate import PchipInterpolator
+        key = (name,inverse)
+        if key not in self._interpolators:
+            x = np.log1p(self._redshift)
+            table = self._table(name)
+            if inverse:
+                self._interpolators[key] = PchipInterpolator(table,x)
+            else:
+                self._interpolators[key] = PchipInterpolator(x,table)
+        return self._interpolators[key]
+
+    def _integrate_redshift_array(self,redshift,r0=0.0):
+        """
+        _integrate_redshift_array(): Returns comoving distance at each of
+                                     the specified redshifts, integrating
+                                     from redshift[0] (where the comoving
+                                     distance is r0) with the selected
+                                     integrator.
+        """
+        if self.integrator == "gauss":
+            return r0 + cumulativeQuadrature(self.f,redshift)
+        from scipy.integrate import romberg
+        r_comoving = np.zeros(len(redshift))
+        r_comoving[0] = r0
+        for i in range(1,len(redshift)):
+            z1 = redshift[i-1]
+            z2 = redshift[i]
+            r_comoving[i] = r_comoving[i-1] + romberg(self.f,z1,z2)
+        return r_comoving
+
+    def _extend_redshift_array(self,zmax):
+        """
+        _extend_redshift_array(): Extend the redshift tables so that they
+                                  cover redshifts up to zmax (or
+                                  Cosmology.zlimit, if smaller). Only the
+                                  missing segment is integrated and appended
+                                  to the existing tables.
+        """
+        zlast = self._redshift[-1]
+        if zmax is None or not np.isfinite(zmax):
+            return
+        zmax = min(zmax,max(self.zlimit,zlast))
+        if zmax <= zlast:
+            return
+        if self.grid == "adaptive":
+            x0 = np.log1p(zlast)
+            x1 = np.log1p(zmax)
+            if x1-x0 < 1.0e-12:
+                return
+            nstart = int(np.ceil(64*(x1-x0)/np.log1p(self._zmax)))
+            x,r = self._adaptive_redshift_array(x0=x0,x1=x1,r0=self._r_comoving[-1],\
+                                                    nstart=max(nstart,1))
+            redshift = np.expm1(x)
+            self._interpolators = {}
+        else:
+            n0 = len(self._redshift)-1
+            n1 = int(np.ceil(zmax*self._inv_dz))+1
+            redshift = np.arange(n0,n1+1)*self._dz
+            r = self._integrate_redshift_array(redshift,r0=self._r_comoving[-1])
+        # Arrays are replaced rather than resized so that tables shared
+        # through tableCache are left untouched
+        t = self._t_lookback[-1] + cumulativeQuadrature(self._dt_dz,redshift)
+        self._redshift = np.append(self._redshift,redshift[1:])
+        self._r_comoving = np.append(self._r_comoving,r[1:])
+        self._t_lookback = np.append(self._t_lookback,t[1:])
+        self._inverse_redshift = None
+        self._derived = {}
+        return
+
+    def _extend_to_value(self,name,vmax):
+        """
+        _extend_to_value(): Extend the redshift tables until the named
+                            (increasing) table covers values up to vmax
+                            (or redshift reaches Cosmology.zlimit).
+        """
+        if vmax is None:
+            return
+        while self._table(name)[-1] < vmax and self._redshift[-1] < self.zlimit:
+            nz = len(self._redshift)
+            self._extend_redshift_array(min(2.0*(1.0+self._redshift[-1])-1.0,self.zlimit))
+            if len(self._redshift) == nz:
+                break
+        return
+
     
+    @staticmethod
+    def _finite_max(values):
+        """
+        _finite_max(): Returns the largest finite entry of values (or None
+                       if there are no finite entries), used to decide how
+                       far to extend the tables.
+        """
+        values = np.asarray(values,dtype=float)
+        if values.size == 0:
+            return None
+        vmax = values.max()
+        if np.isfinite(vmax):
+            return vmax
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return None
+        return values.max()
+
+    def _apply_range_policy(self,values,upper,label):
+        """
+        _apply_range_policy(): Apply the out_of_range policy to values that
+                               should lie in the range [0,upper].
+
+        USAGE: values,outside = _apply_range_policy(values,upper,label)
+
+               Returns values clipped to the range (only copied if
+               necessary) and a mask of entries that should be set to NaN
+               (or None). NaN (and infinite) values always give NaN.
+               With the 'extend' policy, values that remain above upper
+               (i.e. beyond Cosmology.zlimit) are also set to NaN.
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        values = np.asarray(values,dtype=float)
+        # (min and max are NaN, so fail these tests, if any value is NaN)
+        if values.size == 0 or (values.min() >= 0.0 and values.max() <= upper):
+            return values,None
+        below = values < 0.0
+        above = values > upper
+        if self.out_of_range == "raise" and (np.any(below) or np.any(above)):
+            raise ValueError(funcname+"(): "+label+" outside of table range [0,"+\
+                                 str(upper)+"]!")
+        outside = ~np.isfinite(values)
+        if self.out_of_range == "nan":
+            outside |= below
+            outside |= above
+        elif self.out_of_range == "extend":
+            outside |= above
+        values = np.asarray(np.clip(values,0.0,upper))
+        if not np.any(outside):
+            return values,None
+        # Replace values that will be set to NaN by a valid placeholder
+        values[outside] = 0.0
+        return values,outside
+
+    def _uniform_lookup(self,z,table,inv_step=None):
+        """
+        _uniform_lookup(): Linearly interpolate table (tabulated on the
+                           uniform redshift grid) at redshifts z, which
+                           must lie inside the grid.
+
+        Note: the cell index is computed directly as floor(z/dz) rather
+              than by a binary search, so the cost per element is O(1).
+              Tables on other uniform grids starting at zero can be used
+              by specifying inv_step (the inverse of the grid spacing).
+              Non-finite z give NaN.
+        """
+        if inv_step is None:
+            inv_step = self._inv_dz
+        t = np.multiply(np.ravel(z),inv_step)
+        invalid = ~np.isfinite(t)
+        if np.any(invalid):
+            t[invalid] = 0.0
+        else:
+            invalid = None
+        i = t.astype(np.intp)
+        np.minimum(i,len(table)-2,out=i)
+        t -= i
+        lower = table[i]
+        result = table[i+1]
+        result -= lower
+        result *= t
+        result += lower
+        if invalid is not None:
+            result[invalid] = np.nan
+        return result.reshape(np.shape(z))
+
+    def _analytic_comoving_distance(self,z):
+        """
+        _analytic_comoving_distance(): Returns the comoving distance at
+                                       redshifts z for a flat cosmology
+                                       without radiation.
+
+        Note: for omega0 > 0 and lambda0 > 0 the comoving distance is
+              the difference of two incomplete elliptic integrals of the
+              first kind (Gradshteyn & Ryzhik 3.139),
+
+              int_u^inf dx/sqrt(x**3+a**3) = F(phi,sin(75deg))/(3**0.25*sqrt(a)),
+              cos(phi) = (u+(1-sqrt(3))*a)/(u+(1+sqrt(3))*a),
+
+              with a**3 = lambda0/omega0. Redshifts z < 0.1 are integrated
+              directly with Gauss-Legendre quadrature to avoid cancellation
+              between the two terms.
+        """
+        z = np.asarray(z,dtype=float)
+        if self.lambda0 < 1.0e-9:
+            # Einstein de Sitter Universe: 2*(c/H0)*(1-1/sqrt(1+z))
+            sqrtx = np.sqrt(1.0+z)
+            return 2.0*self.HubbleDistance*z/(sqrtx*(sqrtx+1.0))
+        if self.omega0 < 1.0e-9:
+            # de Sitter Universe
+            return self.HubbleDistance*z/np.sqrt(self.lambda0)
+        from scipy.special import ellipkinc
+        a = (self.lambda0/self.omega0)**(1.0/3.0)
+        sqrt3 = np.sqrt(3.0)
+        m = (2.0+sqrt3)/4.0
+        def tail(u):
+            return ellipkinc(np.arccos((u+(1.0-sqrt3)*a)/(u+(1.0+sqrt3)*a)),m)
+        result = tail(1.0) - tail(1.0+z)
+        result *= self.HubbleDistance/np.sqrt(self.omega0*a)/(3.0**0.25)
+        low = z < 0.1
+        if np.any(low):
+            result = np.array(result)
+            result[low] = cellQuadrature(self.f,0.0,z[low])
+        return result
+
+    def _exact_comoving_distance(self,z):
+        """
+        _exact_comoving_distance(): Returns the comoving distance at
+                                    redshifts z (inside the tables) by
+                                    integrating f(z) from the nearest
+                                    table node below z, so that the result
+                                    is accurate to machine precision.
+        """
+        if self.backend == "analytic":
+            return self._analytic_comoving_distance(z)
+        if self._initialize_redshift_array:
+            self._init_redshift_array()
+        z = np.asarray(z,dtype=float)
+        if self.grid == "adaptive":
+            i = np.searchsorted(self._redshift,z,side="right")-1
+        else:
+            i = (z*self._inv_dz).astype(np.intp)
+        i = np.clip(i,0,len(self._redshift)-1)
+        return self._r_comoving[i] + cellQuadrature(self.f,self._redshift[i],z)
+
+    def _inverse_redshift_array(self):
+        """
+        _inverse_redshift_array(): Return the inverse table of redshift on
+                                   a uniform grid in comoving distance and
+                                   the inverse of the grid spacing.
+
+        Note: the inverse table has four times as many nodes as the
+              redshift table, as z(r) steepens at high redshift. Redshifts
+              at the nodes are found by Newton iteration, so they are
+              accurate to machine precision.
+        """
+        if self._inverse_redshift is None:
+            n = 4*(len(self._r_comoving)-1)+1
+            rgrid = np.linspace(0.0,self._r_comoving[-1],n)
+            zgrid = np.interp(rgrid,self._r_comoving,self._redshift)
+            zgrid = self._refine_redshift(rgrid,zgrid)
+            self._inverse_redshift = (zgrid,(n-1)/self._r_comoving[-1])
+        return self._inverse_redshift
+
+    def _analytic_inverse_redshift(self,rmax=None):
+        """
+        _analytic_inverse_redshift(): Return the inverse table of redshift on
+                                      a uniform grid in comoving distance,
+                                      and the inverse of the grid spacing,
+                                      for the 'analytic' backend.
+
+        Note: the table covers comoving distances up to rmax (at most the
+              distance to Cosmology.zlimit), with the same spacing as the
+              inverse table of the 'table' backend (see
+              _inverse_redshift_array()). Redshifts at the nodes are found
+              from the closed-form distances by Newton iteration.
+        """
+        if self._inverse_redshift is not None:
+            zgrid,inv_dr = self._inverse_redshift
+            if rmax is None or (len(zgrid)-1)/inv_dr >= rmax or zgrid[-1] >= self.zlimit:
+                return self._inverse_redshift
+            zmax = zgrid[-1]
+        else:
+            zmax = self._zmax
+        dr = self._analytic_comoving_distance(self._zmax)/(4.0*self._nzmax)
+        while rmax is not None and self._analytic_comoving_distance(zmax) < rmax and \
+                zmax < self.zlimit:
+            zmax = min(2.0*(1.0+zmax)-1.0,self.zlimit)
+        n = int(np.ceil(self._analytic_comoving_distance(zmax)/dr))+1
+        rgrid = np.linspace(0.0,self._analytic_comoving_distance(zmax),n)
+        zguess = np.expm1(np.linspace(0.0,np.log1p(zmax),n))
+        zgrid = np.interp(rgrid,self._analytic_comoving_distance(zguess),zguess)
+        zgrid = self._refine_redshift(rgrid,zgrid)
+        self._inverse_redshift = (zgrid,(n-1)/rgrid[-1])
+        return self._inverse_redshift
+
+    def _refine_redshift(self,r,z,maxiter=10):
+        """
+        _refine_redshift(): Refine estimates, z, of the redshifts at
+                            comoving distances, r, with Newton iterations
+                            using dr/dz = f(z).
+        """
+        z = np.array(z,dtype=float)
+        if self.backend == "analytic":
+            zupper = self.zlimit
+        else:
+            zupper = self._redshift[-1]
+        for i in range(maxiter):
+            dz = self._exact_comoving_distance(z) - r
+            dz /= self.f(z)
+            z -= dz
+            np.clip(z,0.0,zupper,out=z)
+            if np.all(np.fabs(dz) <= 1.0e-14*(1.0+z)):
+                break
+        return z
+
+    def _interpolate_table(self,z,name):
+        """
+        _interpolate_table(): Interpolate the named table at redshifts, z,
+                              applying the out_of_range policy.
+        """
+        if self._initialize_redshift_array:
+            self._init_redshift_array()
+        z = np.asarray(z,dtype=float)
+        if self.out_of_range == "extend" and z.size > 0:
+            self._extend_redshift_array(self._finite_max(z))
+        z,outside = self._apply_range_policy(z,self._redshift[-1],"redshift")
+        if self.grid == "adaptive":
+            result = self._adaptive_interpolator(name)(np.log1p(z))
+        else:
+            result = self._uniform_lookup(z,self._table(name))
+        if outside is not None:
+            result = np.asarray(result)
+            result[outside] = np.nan
+        return result[()]
+
+    def _invert_table(self,values,name):
+        """
+        _invert_table(): Returns the redshifts at which the named
+                         (increasing) table takes the specified values,
+                         applying the out_of_range policy.
+        """
+        if self._initialize_redshift_array:
+            self._init_redshift_array()
+        values = np.asarray(values,dtype=float)
+        if self.out_of_range == "extend" and values.size > 0:
+            self._extend_to_value(name,self._finite_max(values))
+        table = self._table(name)
+        values,outside = self._apply_range_policy(values,table[-1],name)
+        if self.grid == "adaptive":
+            result = np.expm1(self._adaptive_interpolator(name,inverse=True)(values))
+        else:
+            result = np.interp(values,table,self._redshift)
+        if outside is not None:
+            result = np.asarray(result)
+            result[outside] = np.nan
+        return result[()]
+
     def comoving_distance(self,z=0.0):
         """
         comoving_distance(): Returns the comoving distance (in Mpc/h)
                              corresponding to redshift, z.
         
         USAGE: comoving_distance(z)
+
+        Note: redshifts outside of the tables are treated according to
+              the out_of_range policy. With the 'analytic' backend only
+              negative redshifts are outside of the valid range.
         
         """
-        if self._initialize_redshift_array:
-            self._init_redshift_array()
-        return np.interp(z,self._redshift,self._r_comoving)
+        if self.backend == "analytic":
+            z,outside = self._apply_range_policy(z,np.inf,"redshift")
+            result = np.array(self._analytic_comoving_distance(z))
+            if outside is not None:
+                result = np.asarray(result)
+                result[outside] = np.nan
+            return result[()]
+        return self._interpolate_table(z,"r_comoving")
 
     
-    def redshift_at_distance(self,r=0.0):
+    def redshift_at_distance(self,r=0.0,refine=False):
         """
         redshift_at_distance(): Returns the redshift corresponding
                                 to comoving distance, r (in Mpc/h).
             
-        USAGE: redshift_at_distance(z)
+        USAGE: redshift_at_distance(r,[refine])
+
+               refine -- Apply Newton iterations to the interpolated
+                         redshifts so that they are accurate to machine
+                         precision. (Default = False).
+
+        Note: on the uniform grid (and with the 'analytic' backend)
+              redshifts are interpolated from an inverse table that is
+              uniform in comoving distance, so the cost per element is
+              O(1).
         
         """
+        if self.backend == "analytic":
+            rmax = self._analytic_comoving_distance(self.zlimit)
+            r,outside = self._apply_range_policy(r,rmax,"distance")
+            zgrid,inv_dr = self._analytic_inverse_redshift(self._finite_max(r))
+            result = self._uniform_lookup(r,zgrid,inv_step=inv_dr)
+            if refine:
+                result = self._refine_redshift(r,result)
+            if outside is not None:
+                result = np.asarray(result)
+                result[outside] = np.nan
+            return result[()]
         if self._initialize_redshift_array:
             self._init_redshift_array()
-        return np.interp(r,self._r_comoving,self._redshift)
+        r = np.asarray(r,dtype=float)
+        if self.out_of_range == "extend" and r.size > 0:
+            self._extend_to_value("r_comoving",self._finite_max(r))
+        r,outside = self._apply_range_policy(r,self._r_comoving[-1],"distance")
+        if self.grid == "adaptive":
+            result = np.expm1(self._adaptive_interpolator("r_comoving",inverse=True)(r))
+        else:
+            zgrid,inv_dr = self._inverse_redshift_array()
+            result = self._uniform_lookup(r,zgrid,inv_step=inv_dr)
+        if refine:
+            result = self._refine_redshift(r,result)
+        if outside is not None:
+            result = np.asarray(result)
+            result[outside] = np.nan
+        return result[()]
     
     
+    def _present_age(self):
+        """
+        _present_age(): Returns the present age of the Universe (in Gyr).
+
+        Note: integrates da/(a*H) from a = 0 to 1 with the substitution
+              a = u**2, which removes the singular behaviour of the
+              integrand at a = 0.
+        """
+        if self._age0 is None:
+            def integrand(u):
+                a = u*u
+                return 2.0*u*a/np.sqrt(self.omegar + self.omega0*a + self.omegak*(a**2) + \
+                                           self.lambda0*(a**4))
+            u = np.linspace(0.0,1.0,65)
+            self._age0 = self.HubbleTime*cumulativeQuadrature(integrand,u)[-1]
+        return self._age0
+
     def age_of_universe(self,z=0.0):
         """
         age_of_universe(): Returns the age of the Universe (in Gyr) at
@@ -188,34 +1202,13 @@ class Cosmology(object):
         
         USAGE: age_of_universe(z)
 
-        Note: equations from Mo, van den Bosch & White (2010) Ch.3 Eq. 3.96-3.99
+        Note: computed as the present age minus the lookback time, which
+              is interpolated from a table built alongside the comoving
+              distance table, so any combination of omega0, lambda0,
+              omegak and omegar is supported.
         
         """
-        a = 1.0/(1.0+z)
-        result = None
-        if np.fabs(self.lambda0) < 1.0e-9: # lambda0 = 0
-            if self.omega0 == 1.0 : 
-                # Einstein de Sitter Universe (Mo et al. 2010, Eq. 3.96)
-                result = self.HubbleTime*(2.0/3.0)*(a**(3.0/2.0))
-            elif self.omega0 < 1:
-                # Open Universe with lambda0 = 0 and omega0 < 1 (Mo et al. 2010, Eq. 3.97)
-                factor1 = self.HubbleTime*self.omega0/2.0/((1.0-self.omega0)**(3.0/2.0))
-                factor2 = 2.0*np.sqrt((1-self.omega0)*(self.omega0*z+1.0))/self.omega0/(1.0+z)
-                factor3 = -np.arccosh((self.omega0*z-self.omega0+2.0)/(self.omega0*(1.0+z)))
-                result = factor1*(factor2+factor3)
-            else:
-                # Closed Universe with lambda = 0 and omega > 1 (Mo et al. 2010, Eq. 3.98)
-                factor1 = self.HubbleTime*self.omega0/2.0/((self.omega0-1.0)**(3.0/2.0))                
-                factor2 = -2.0*np.sqrt((self.omega0-1.0)*(self.omega0*z+1.0))/self.omega0/(1.0+z)
-                factor3 = np.arccos((self.omega0*z-self.omega0+2.0)/(self.omega0*(1.0+z)))
-                result = factor1*(factor2+factor3)
-        else:
-            # Flat Universe with lambda0 + omega0 = 1 (Mo et al. 2010, Eq. 3.99)
-            if np.fabs(self.lambda0+self.omega0-1.0) < 1.0e-9:
-                factor1 = self.HubbleTime*(2.0/3.0)/np.sqrt(self.lambda0)
-                factor2 = np.sqrt(self.lambda0*(a**3)) + np.sqrt(self.lambda0*(a**3)+self.omega0)
-                result = factor1*np.log(factor2/np.sqrt(self.omega0))
-        return result
+        return self._present_age() - self.lookback_time(z)
             
             
     def lookback_time(self,z=0.0):
@@ -226,12 +1219,47 @@ class Cosmology(object):
         USAGE: lookback_time(z)
         
         """
-        t = self.age_of_universe(0.0) - self.age_of_universe(z)
-        return t
+        return self._interpolate_table(z,"t_lookback")
+
+
+    def redshift_at_age(self,t):
+        """
+        redshift_at_age(): Returns the redshift at which the Universe
+                           has age, t (in Gyr).
+
+        USAGE: redshift_at_age(t)
+
+        """
+        t = np.asarray(t,dtype=float)
+        return self._invert_table(self._present_age()-t,"t_lookback")
 
 
 
     
+    def growth_factor(self,z=0.0):
+        """
+        growth_factor(): Returns the linear growth factor, D(z),
+                         normalised to D(0) = 1.
+
+        USAGE: growth_factor(z)
+
+        Note: interpolated from a table solved once for the redshift grid,
+              including curvature and radiation (see E(z)).
+
+        """
+        return self._interpolate_table(z,"growth_factor")
+
+
+    def growth_rate(self,z=0.0):
+        """
+        growth_rate(): Returns the linear growth rate, f(z) = dlnD/dlna.
+
+        USAGE: growth_rate(z)
+
+        """
+        return self._interpolate_table(z,"growth_rate")
+
+
     def comoving_transverse_distance(self,z=0.0):
         """
         comoving_transverse_distance(): Returns the transverse comoving distance (in Mpc/h or) 
@@ -242,16 +1270,23 @@ class Cosmology(object):
 
         Note: from Hogg (1999) Eq.16.
         """
+        return self._transverse_from_comoving(self.comoving_distance(z))
+
+    def _transverse_from_comoving(self,DC):
+        """
+        _transverse_from_comoving(): Returns the transverse comoving
+                                     distance for comoving distance, DC.
+        """
         if self.omegak > 0:
             result = self.HubbleDistance
-            result *= np.sinh(np.sqrt(self.omegak)*self.comoving_distance(z)/self.HubbleDistance)
+            result *= np.sinh(np.sqrt(self.omegak)*DC/self.HubbleDistance)
             result /= np.sqrt(self.omegak)
         elif self.omegak < 0:
             result = self.HubbleDistance
-            result *= np.sin(np.sqrt(np.fabs(self.omegak))*self.comoving_distance(z)/self.HubbleDistance)
+            result *= np.sin(np.sqrt(np.fabs(self.omegak))*DC/self.HubbleDistance)
             result /= np.sqrt(np.fabs(self.omegak))
         else:
-            result = self.comoving_distance(z)
+            result = DC
         return result
 
 
@@ -316,9 +1351,7 @@ class Cosmology(object):
         USAGE: luminosity_distance(z)
         
         """
-        da = self.angular_diameter_distance(z)*self.Mpc/(c/self.H0SI)
-        dL = (c/self.H0SI)*da*((1.0+z)**2)/self.Mpc
-        return dL
+        return self.comoving_transverse_distance(z)*(1.0+np.asarray(z))
     
 
     def comoving_volume(self,z=0.0):
@@ -329,11 +1362,20 @@ class Cosmology(object):
         
         USAGE: comoving_volume(z)
         
-        Note: From Hogg (1999) Eq.29
+        Note: From Hogg (1999) Eq.29. With the 'table' backend the volume
+              is interpolated from a table built alongside the comoving
+              distance table.
 
         """
+        if self.backend == "table":
+            return self._interpolate_table(z,"v_comoving_cbrt")**3
+        return self._volume_from_transverse(self.comoving_transverse_distance(z))
 
-        DM = self.comoving_transverse_distance(z)        
+    def _volume_from_transverse(self,DM):
+        """
+        _volume_from_transverse(): Returns the comoving volume for
+                                   transverse comoving distance, DM.
+        """
         if self.omegak > 0.0:
             DMDH = DM/self.HubbleDistance            
             factor1 = 4.0*Pi*self.HubbleVolume/2.0/self.omegak
@@ -348,6 +1390,12 @@ class Cosmology(object):
             result = factor1*(factor2+factor3)
         else:
             result = 4.0*Pi*(DM**3)/3.0
+        if self.omegak != 0.0:
+            # Hogg Eq.29 cancels catastrophically when omegak*(DM/DH)^2 is
+            # small, so use its series expansion there instead.
+            x = self.omegak*(DM/self.HubbleDistance)**2
+            series = 4.0*Pi*(DM**3)/3.0*(1.0-0.3*x+9.0*(x**2)/56.0)
+            result = np.where(np.fabs(x) < 1.0e-3,series,result)[()]
         return result
 
     
@@ -361,10 +1409,42 @@ class Cosmology(object):
         
         USAGE: dVdz(z)
 
+        Note: with the 'table' backend dV/dz is interpolated from a table
+              built alongside the comoving distance table.
+
         """
+        if self.backend == "table":
+            return self._interpolate_table(z,"dvdz_sqrt")**2
         dA = self.angular_diameter_distance(z)
         dV = self.HubbleDistance*(dA**2)*((1.0+z)**2)/self.E(z)
         return dV*4.0*Pi
+
+
+    def redshift_at_volume(self,V):
+        """
+        redshift_at_volume(): Returns the redshift at which the comoving
+                              volume (in Mpc^3) of a sphere centred on the
+                              observer is V.
+
+        USAGE: redshift_at_volume(V)
+
+        """
+        return self._invert_table(np.cbrt(V),"v_comoving_cbrt")
+
+
+    def random_redshifts(self,n,zmin=0.0,zmax=1.0,rng=None):
+        """
+        random_redshifts(): Returns n redshifts drawn at random, uniformly
+                            in comoving volume, between zmin and zmax.
+
+        USAGE: z = random_redshifts(n,[zmin],[zmax],[rng])
+
+               rng -- numpy random Generator (or seed). (Default = None).
+
+        """
+        rng = np.random.default_rng(rng)
+        vmin,vmax = self._interpolate_table([zmin,zmax],"v_comoving_cbrt")**3
+        return self.redshift_at_volume(rng.uniform(vmin,vmax,n))
     
 
     def band_corrected_distance_modulus(self,z=0.0):
@@ -387,36 +1467,315 @@ class Cosmology(object):
         return bcdm
 
 
-    def realspace(self,ra,dec,z):
-        ra = np.radians(ra)
-        dec = np.radians(dec)
-        r = self.comoving_distance(z)
-        XX = r*np.cos(dec)*np.cos(ra)
-        YY = r*np.cos(dec)*np.sin(ra)
-        ZZ = r*np.sin(dec)
-        return XX,YY,ZZ
+    @staticmethod
+    def _flat_outputs(funcname,out,shape,count):
+        """
+        _flat_outputs(): Returns flattened views of the count arrays in out,
+                         each of which must have the specified shape and be
+                         writeable without copying (e.g. contiguous), so that
+                         results written to the views are stored in out.
+        """
+        if out is None or len(out) != count:
+            raise ValueError(funcname+"(): output must be "+str(count)+" arrays of shape "+str(shape)+".")
+        flat = []
+        for arr in out:
+            if not isinstance(arr,np.ndarray) or arr.shape != shape:
+                raise ValueError(funcname+"(): output arrays must have shape "+str(shape)+".")
+            view = arr.reshape(-1)
+            if not arr.flags.writeable or (view.size > 0 and not np.may_share_memory(view,arr)):
+                raise ValueError(funcname+"(): output arrays must be writeable and contiguous.")
+            flat.append(view)
+        return flat
+
+    def distances(self,z,out=None,chunksize=65536):
+        """
+        distances(): Returns the transverse comoving distance, angular
+                     diameter distance, luminosity distance (all in Mpc/h)
+                     and band corrected distance modulus at redshifts, z,
+                     computed together in a single pass.
+
+        USAGE: DM,DA,DL,BCDM = distances(z,[out],[chunksize])
+
+              out       -- Tuple of four preallocated, contiguous arrays
+                           (each with the shape of z) in which to store
+                           the results.
+                           (Default = None, allocate new arrays).
+              chunksize -- Number of redshifts processed at a time, which
+                           bounds the size of temporary arrays.
+                           (Default = 65536).
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        z = np.asarray(z,dtype=float)
+        if out is None:
+            out = tuple([np.empty(z.shape) for i in range(4)])
+        DM,DA,DL,BCDM = self._flat_outputs(funcname,out,z.shape,4)
+        zflat = np.ravel(z)
+        dref = 10.0/constants.mega # 10pc in Mpc
+        sqrtk = np.sqrt(np.fabs(self.omegak))
+        for start in range(0,zflat.size,chunksize):
+            sl = slice(start,start+chunksize)
+            dm = DM[sl]
+            dm[:] = self.comoving_distance(zflat[sl])
+            if self.omegak > 0.0:
+                dm *= sqrtk/self.HubbleDistance
+                np.sinh(dm,out=dm)
+                dm *= self.HubbleDistance/sqrtk
+            elif self.omegak < 0.0:
+                dm *= sqrtk/self.HubbleDistance
+                np.sin(dm,out=dm)
+                dm *= self.HubbleDistance/sqrtk
+            # Store 1+z in DL, then compute distances in place
+            onepz = DL[sl]
+            np.add(zflat[sl],1.0,out=onepz)
+            np.divide(dm,onepz,out=DA[sl])
+            bcdm = BCDM[sl]
+            np.log10(onepz,out=bcdm)
+            bcdm *= -2.5
+            np.multiply(dm,onepz,out=onepz)
+            bcdm += 5.0*np.log10(onepz/dref)
+        return out
+
+    def realspace(self,ra,dec,z,out=None,chunksize=65536):
+        """
+        realspace(): Returns the Cartesian comoving position (in Mpc/h) of
+                     objects at right ascension, ra, declination, dec
+                     (both in degrees) and redshift, z.
+
+        USAGE: XX,YY,ZZ = realspace(ra,dec,z)
+               pos = realspace(ra,dec,z,out=pos,[chunksize])
+
+              out       -- Preallocated (N,3) float32 or float64 array in
+                           which to store the positions, which is then
+                           returned. May be a numpy memmap.
+                           (Default = None, return three new arrays).
+              chunksize -- Number of objects processed at a time, which
+                           bounds the size of temporary arrays.
+                           (Default = 65536).
+
+        Note: the inputs are read one chunk at a time, so memory-mapped
+              inputs and outputs are streamed without being loaded into
+              memory.
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        shape = np.broadcast(ra,dec,z).shape
+        ra,dec,z = [np.ravel(arr) if np.shape(arr) == shape else \
+                        np.ravel(np.broadcast_to(arr,shape)) for arr in [ra,dec,z]]
+        n = z.size
+        if out is None:
+            pos = np.empty((n,3))
+        else:
+            if np.ndim(out) != 2 or out.shape != (n,3):
+                raise ValueError(funcname+"(): output array must have shape ("+str(n)+",3).")
+            pos = out
+        for start in range(0,n,chunksize):
+            sl = slice(start,start+chunksize)
+            r = self.comoving_distance(z[sl])
+            angle = np.radians(dec[sl])
+            pos[sl,2] = r*np.sin(angle)
+            r *= np.cos(angle)
+            np.radians(ra[sl],out=angle)
+            pos[sl,0] = r*np.cos(angle)
+            pos[sl,1] = r*np.sin(angle)
+        if out is not None:
+            return out
+        return tuple([pos[:,i].reshape(shape)[()] for i in range(3)])
+
+    def skyspace(self,x,y,z,out=None,chunksize=65536,refine=False):
+        """
+        skyspace(): Returns the right ascension and declination (both in
+                    degrees) and redshift of objects at Cartesian comoving
+                    position x,y,z (in Mpc/h). The inverse of realspace().
+
+        USAGE: ra,dec,redshift = skyspace(x,y,z,[out],[chunksize],[refine])
+
+              out       -- Tuple of three preallocated, contiguous arrays
+                           (each with the shape of x) in which to store
+                           the results. May be numpy memmaps.
+                           (Default = None, allocate new arrays).
+              chunksize -- Number of objects processed at a time, which
+                           bounds the size of temporary arrays.
+                           (Default = 65536).
+              refine    -- Solve for redshifts to machine precision (see
+                           redshift_at_distance()). (Default = False).
+
+        Note: right ascensions are returned in the range [0,360).
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        shape = np.broadcast(x,y,z).shape
+        x,y,z = [np.ravel(arr) if np.shape(arr) == shape else \
+                     np.ravel(np.broadcast_to(arr,shape)) for arr in [x,y,z]]
+        allocate = out is None
+        if allocate:
+            out = tuple([np.empty(shape) for i in range(3)])
+        RA,DEC,REDSHIFT = self._flat_outputs(funcname,out,shape,3)
+        for start in range(0,x.size,chunksize):
+            sl = slice(start,start+chunksize)
+            xx = np.asarray(x[sl],dtype=float)
+            yy = np.asarray(y[sl],dtype=float)
+            zz = np.asarray(z[sl],dtype=float)
+            rho = np.hypot(xx,yy)
+            RA[sl] = np.mod(np.degrees(np.arctan2(yy,xx)),360.0)
+            DEC[sl] = np.degrees(np.arctan2(zz,rho))
+            np.hypot(rho,zz,out=rho)
+            REDSHIFT[sl] = self.redshift_at_distance(rho,refine=refine)
+        if allocate:
+            return tuple([arr[()] for arr in out])
+        return out
 
     #
     # Functions for N-body simulations
     #
+    # Masses are in Msun/h and lengths in Mpc/h. All arguments broadcast
+    # against each other, so many simulation configurations or haloes can
+    # be converted in a single call.
+    #
     def particleMass(self,boxSize,particlesPerSide):
-        numberDensity = (float(particlesPerSide)/float(boxSize))**3
-        return self.criticalDensity*self.omega0/numberDensity
+        numberDensity = (np.asarray(particlesPerSide,dtype=float)/np.asarray(boxSize,dtype=float))**3
+        return (self.criticalDensity*self.omega0/numberDensity)[()]
 
     def boxSize(self,particleMass,particlesPerSide):
-        boxSize = particleMass*(particlesPerSide**3)
+        boxSize = np.asarray(particleMass,dtype=float)*(np.asarray(particlesPerSide,dtype=float)**3)
         boxSize /= self.criticalDensity*self.omega0
-        return boxSize**(1.0/3.0)
+        return np.cbrt(boxSize)[()]
     
     def particlesPerSide(self,boxSize,particleMass):
-        return (self.criticalDensity*self.omega0*(boxSize**3)/particleMass)**(1.0/3.0)
+        result = self.criticalDensity*self.omega0*(np.asarray(boxSize,dtype=float)**3)
+        return np.cbrt(result/np.asarray(particleMass,dtype=float))[()]
+
+    def omega_matter(self,z=0.0):
+        """
+        omega_matter(): Returns the matter density parameter at redshift, z.
+
+        USAGE: omega_matter(z)
+
+        """
+        z = np.asarray(z,dtype=float)
+        return (self.omega0*(1.0+z)**3/self.E(z)**2)[()]
+
+    def critical_density(self,z=0.0):
+        """
+        critical_density(): Returns the critical density (in h^2 Msun/Mpc^3)
+                            at redshift, z.
+
+        USAGE: critical_density(z)
+
+        """
+        return (self.criticalDensity*np.asarray(self.E(np.asarray(z,dtype=float)))**2)[()]
+
+    def overdensity(self,z=0.0,definition="200c"):
+        """
+        overdensity(): Returns the mean overdensity of a halo, relative to
+                       the critical density at redshift, z.
+
+        USAGE: overdensity(z,[definition])
+
+               definition -- Halo definition: 'vir' for the virial
+                             overdensity of Bryan & Norman (1998), or a
+                             number followed by 'c' or 'm' for overdensity
+                             with respect to the critical or mean matter
+                             density, e.g. '200c', '500c', '200m'.
+                             (Default = '200c').
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        definition = str(definition).lower()
+        z = np.asarray(z,dtype=float)
+        if definition == "vir":
+            x = np.asarray(self.omega_matter(z)) - 1.0
+            if self.lambda0 == 0.0:
+                result = 18.0*Pi**2 + 60.0*x - 32.0*x**2
+            else:
+                result = 18.0*Pi**2 + 82.0*x - 39.0*x**2
+            return result[()]
+        try:
+            delta = float(definition[:-1])
+        except ValueError:
+            delta = None
+        if delta is None or definition[-1] not in ["c","m"]:
+            raise ValueError(funcname+"(): halo definition '"+definition+\
+                                 "' not recognised! Use 'vir' or e.g. '200c', '200m'.")
+        if definition[-1] == "m":
+            return (delta*np.asarray(self.omega_matter(z)))[()]
+        return (delta*np.ones_like(z))[()]
+
+    def virial_radius(self,mass,z=0.0,definition="200c"):
+        """
+        virial_radius(): Returns the (physical) radius in Mpc/h of a halo
+                         of mass, mass (in Msun/h), at redshift, z.
+
+        USAGE: virial_radius(mass,[z],[definition])
+
+        Note: see overdensity() for the available halo definitions.
+
+        """
+        rho = self.overdensity(z,definition)*self.critical_density(z)
+        return np.cbrt(3.0*np.asarray(mass,dtype=float)/(4.0*Pi*rho))[()]
+
+    def virial_mass(self,radius,z=0.0,definition="200c"):
+        """
+        virial_mass(): Returns the mass in Msun/h of a halo with (physical)
+                       radius, radius (in Mpc/h), at redshift, z.
+
+        USAGE: virial_mass(radius,[z],[definition])
+
+        """
+        rho = self.overdensity(z,definition)*self.critical_density(z)
+        return (4.0*Pi*rho*np.asarray(radius,dtype=float)**3/3.0)[()]
+
+    def circular_velocity(self,mass,radius):
+        """
+        circular_velocity(): Returns the circular velocity (in km/s) at
+                             radius, radius (in Mpc/h), enclosing mass,
+                             mass (in Msun/h).
+
+        USAGE: circular_velocity(mass,radius)
+
+        """
+        G = constants.gravitationalConstant*massSolar/self.Mpc/constants.kilo**2 # Mpc (km/s)^2/Msun
+        return np.sqrt(G*np.asarray(mass,dtype=float)/np.asarray(radius,dtype=float))[()]
+
+    def halo_catalog(self,mass,z=0.0,definition="200c",particleMass=None):
+        """
+        halo_catalog(): Returns the radius, circular velocity and
+                        (optionally) number of particles of haloes with
+                        masses, mass (in Msun/h), at redshifts, z.
+
+        USAGE: halos = halo_catalog(mass,[z],[definition],[particleMass])
+
+               particleMass -- Mass of simulation particle (in Msun/h).
+                               If given, the number of particles in each
+                               halo (mass/particleMass, rounded to the
+                               nearest integer) is included. (Default = None).
+
+        Output is a numpy structured array with fields 'mass', 'radius'
+        (physical, in Mpc/h), 'vcirc' (circular velocity at radius, in
+        km/s) and, if particleMass is given, 'particles'.
+
+        """
+        mass,z = np.broadcast_arrays(np.asarray(mass,dtype=float),np.asarray(z,dtype=float))
+        names = ["mass","radius","vcirc"]
+        if particleMass is not None:
+            names.append("particles")
+        halos = np.zeros(mass.shape,dtype=[(name,np.int64 if name == "particles" else float) \
+                                               for name in names])
+        halos["mass"] = mass
+        halos["radius"] = self.virial_radius(mass,z,definition)
+        halos["vcirc"] = self.circular_velocity(mass,halos["radius"])
+        if particleMass is not None:
+            halos["particles"] = np.rint(mass/particleMass)
+        return halos
 
 
 
 
 class WMAP(Cosmology):
     
-    def __init__(self,year,h_independent=True,radiation=False,zmax=20.0,nzmax=10000):
+    def __init__(self,year,h_independent=True,radiation=False,zmax=20.0,nzmax=10000,\
+                     integrator="gauss",cache=True,grid="uniform",rtol=1.0e-6,\
+                     out_of_range="extend",backend="auto"):
         classname = self.__class__.__name__
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
         self.year = year        
@@ -445,40 +1804,408 @@ class WMAP(Cosmology):
             print("           Select one of the following years: 1,3,5,7,9.")                        
         super(WMAP, self).__init__(omega0=omega0,lambda0=lambda0,omegab=omegab,h0=h0,\
                                        sigma8=sigma8,ns=ns,radiation=radiation,\
-                                       zmax=zmax,nzmax=nzmax,h_independent=h_independent)
+                                       zmax=zmax,nzmax=nzmax,h_independent=h_independent,\
+                                       integrator=integrator,cache=cache,\
+                                       grid=grid,rtol=rtol,out_of_range=out_of_range,\
+                                       backend=backend)
         return
 
 
+class CosmologyGrid(object):
+    """
+    CosmologyGrid: class to compute distances for a grid of cosmologies
+                   in a single broadcast integration.
+
+          USAGE: GRID = CosmologyGrid(omega0,lambda0,[h0],[radiation],
+                                      [h_independent],[chunksize],[dz])
+
+          INPUTS
+               omega0 -- Array of matter densities.
+              lambda0 -- Array of cosmological constant densities.
+                   h0 -- Array of dimensionless Hubble constants.
+                         (Default = 0.73).
+            radiation -- Include radiation density (as for Cosmology).
+                         (Default = False).
+        h_independent -- Return distances in Mpc/h (as for Cosmology).
+                         (Default = True).
+            chunksize -- Number of cosmologies integrated at once. Memory
+                         use scales as chunksize*zmax/dz. (Default = 64).
+                   dz -- Maximum width of integration cells, each of which
+                         is integrated with an 8-point Gauss-Legendre rule.
+                         (Default = 0.05).
+
+          Parameters are broadcast against each other. All functions
+          return arrays of shape (n_cosmo,)+shape(z).
+
+    List of functions:
+
+    comoving_distance() : calculates the comoving distance at redshift, z
+    comoving_transverse_distance() : calculates the transverse comoving
+                                     distance at redshift, z
+    angular_diameter_distance() : calculates the angular diameter distance
+                                  at redshift, z
+    luminosity_distance() : calculates the luminosity distance at redshift, z
+    dVdz() : calculates dV/dz at redshift, z
+    E() : returns Peebles' E(z) function at redshift, z
+
+    """
+    def __init__(self,omega0,lambda0,h0=0.73,radiation=False,h_independent=True,\
+                     chunksize=64,dz=0.05):
+        omega0,lambda0,h0 = np.broadcast_arrays(np.atleast_1d(omega0),\
+                                                    np.atleast_1d(lambda0),\
+                                                    np.atleast_1d(h0))
+        self.omega0 = np.array(omega0,dtype=float).ravel()
+        self.lambda0 = np.array(lambda0,dtype=float).ravel()
+        self.h0 = np.array(h0,dtype=float).ravel()
+        if radiation:
+            self.omegar = (4.165e-5)/(self.h0**2)
+        else:
+            self.omegar = np.zeros_like(self.h0)
+        self.omegak = 1.0 - (self.omega0 + self.lambda0 + self.omegar)
+        if h_independent:
+            self.H0 = np.full_like(self.h0,100.0)
+        else:
+            self.H0 = 100.0*self.h0
+        self.h_independent = h_independent
+        self.HubbleDistance = c/constants.kilo/self.H0
+        self.chunksize = chunksize
+        self.dz = dz
+        self._last = None
+        return
+
+    def __len__(self):
+        return len(self.omega0)
+
+    def _column(self,values,sl):
+        return values[sl,np.newaxis,np.newaxis]
+
+    def E(self,z=0.0):
+        """
+        E(z): Peebles' E(z) function for each cosmology.
+
+        """
+        a = 1.0/(1.0+np.asarray(z,dtype=float))
+        shape = (len(self),)+(1,)*np.ndim(a)
+        result = self.omegak.reshape(shape)*(a**-2) + self.lambda0.reshape(shape) + \
+                 self.omega0.reshape(shape)*(a**-3) + self.omegar.reshape(shape)*(a**-4)
+        return np.sqrt(result)
+
+    def comoving_distance(self,z=0.0):
+        """
+        comoving_distance(): Returns the comoving distance (in Mpc/h)
+                             for each cosmology at redshift, z.
+
+        USAGE: comoving_distance(z)
+
+        Note: the integration is carried out on the union of the requested
+              redshifts and a grid of spacing dz, chunking over the
+              cosmologies. The result for the last redshift array is
+              retained so that other distances can reuse it. Redshifts must
+              be finite and non-negative.
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        z = np.asarray(z,dtype=float)
+        if z.size == 0:
+            return np.empty((len(self),)+z.shape)
+        if not np.all(np.isfinite(z)) or np.any(z < 0.0):
+            raise ValueError(funcname+"(): redshifts must be finite and non-negative!")
+        if self._last is not None and self._last[0].shape == z.shape and \
+                np.array_equal(self._last[0],z):
+            return self._last[1]
+        zq,inverse = np.unique(z.ravel(),return_inverse=True)
+        ncells = int(np.ceil(max(zq.max(),0.0)/self.dz))
+        nodes = np.union1d(np.linspace(0.0,ncells*self.dz,ncells+1),zq)
+        index = np.searchsorted(nodes,zq)
+        result = np.empty((len(self),len(zq)))
+        for start in range(0,len(self),self.chunksize):
+            sl = slice(start,start+self.chunksize)
+            def integrand(x):
+                a = 1.0/(1.0+x)
+                E2 = self._column(self.omegak,sl)*(a**-2) + self._column(self.lambda0,sl) + \
+                     self._column(self.omega0,sl)*(a**-3) + self._column(self.omegar,sl)*(a**-4)
+                return 1.0/np.sqrt(E2)
+            cells = cellQuadrature(integrand,nodes[:-1],nodes[1:])
+            cumulative = np.zeros((cells.shape[0],len(nodes)))
+            np.cumsum(cells,axis=1,out=cumulative[:,1:])
+            result[sl] = cumulative[:,index]*self.HubbleDistance[sl,np.newaxis]
+        result = result[:,inverse].reshape((len(self),)+z.shape)
+        self._last = (z.copy(),result)
+        return result
+
+    def comoving_transverse_distance(self,z=0.0):
+        """
+        comoving_transverse_distance(): Returns the transverse comoving
+                                        distance (in Mpc/h) for each
+                                        cosmology at redshift, z.
+
+        USAGE: comoving_transverse_distance(z)
+
+        Note: from Hogg (1999) Eq.16.
+        """
+        DC = self.comoving_distance(z)
+        shape = (len(self),)+(1,)*(DC.ndim-1)
+        sqrtk = np.sqrt(np.fabs(self.omegak)).reshape(shape)
+        DH = self.HubbleDistance.reshape(shape)
+        omegak = self.omegak.reshape(shape)
+        with np.errstate(divide="ignore",invalid="ignore"):
+            open_ = DH*np.sinh(sqrtk*DC/DH)/sqrtk
+            closed = DH*np.sin(sqrtk*DC/DH)/sqrtk
+        return np.where(omegak > 0.0,open_,np.where(omegak < 0.0,closed,DC))
+
+    def angular_diameter_distance(self,z=0.0):
+        """
+        angular_diameter_distance(): Returns the angular diameter distance
+                                     (in Mpc/h) for each cosmology at
+                                     redshift, z.
+
+        USAGE: angular_diameter_distance(z)
+
+        Note: from Hogg (1999) Eq.18
+        """
+        return self.comoving_transverse_distance(z)/(1.0+np.asarray(z))
+
+    def luminosity_distance(self,z=0.0):
+        """
+        luminosity_distance(): Returns the luminosity distance (in Mpc/h)
+                               for each cosmology at redshift, z.
+
+        USAGE: luminosity_distance(z)
+
+        """
+        return self.comoving_transverse_distance(z)*(1.0+np.asarray(z))
+
+    def dVdz(self,z=0.0):
+        """
+        dVdz() : Returns the comoving volume element dV/dz for each
+                 cosmology at redshift, z, for all sky.
+
+        USAGE: dVdz(z)
+
+        """
+        dA = self.angular_diameter_distance(z)
+        shape = (len(self),)+(1,)*(dA.ndim-1)
+        dV = self.HubbleDistance.reshape(shape)*(dA**2)*((1.0+np.asarray(z))**2)/self.E(z)
+        return dV*4.0*Pi
+
+
+
+_RSD_COSMOLOGY = None
+
+def _redshiftSpaceInit(cosmology):
+    global _RSD_COSMOLOGY
+    _RSD_COSMOLOGY = cosmology
+    return
+
+def _redshiftSpaceChunk(args):
+    return _redshiftSpaceKernel(_RSD_COSMOLOGY,*args)
+
+def _redshiftSpaceKernel(cosmology,pos,vel):
+    """
+    _redshiftSpaceKernel(): Returns redshift-space positions and observed
+                            redshifts for one chunk of objects.
+    """
+    pos = np.asarray(pos,dtype=float)
+    vel = np.asarray(vel,dtype=float)
+    r = np.sqrt(np.einsum("ij,ij->i",pos,pos))
+    z = cosmology.redshift_at_distance(r)
+    # Line-of-sight velocity (in km/s), zero for objects at the observer
+    vlos = np.einsum("ij,ij->i",pos,vel)
+    np.divide(vlos,r,out=vlos,where=r>0.0)
+    vlos[r==0.0] = 0.0
+    # 1+z_obs = (1+z_cos)(1+v_los/c)
+    zobs = z + vlos*(1.0+z)/(c/1000.0)
+    rs = cosmology.comoving_distance(np.maximum(zobs,0.0))
+    scale = np.ones_like(r)
+    np.divide(rs,r,out=scale,where=r>0.0)
+    return pos*scale[:,np.newaxis],zobs
+
+
+def redshiftSpace(positions,velocities,cosmology,out=None,redshifts=None,\
+                      chunksize=65536,processes=None):
+    """
+    redshiftSpace(): Returns the redshift-space positions and observed
+                     redshifts of objects with real-space comoving
+                     positions (in Mpc/h, relative to an observer at the
+                     origin) and peculiar velocities (in km/s).
+
+    USAGE: pos,zobs = redshiftSpace(positions,velocities,cosmology,[out],
+                                    [redshifts],[chunksize],[processes])
+
+           positions  -- (N,3) array of comoving positions, e.g. from
+                         Cosmology.realspace().
+           velocities -- (N,3) array of peculiar velocities.
+           cosmology  -- Cosmology instance used to convert between
+                         redshift and comoving distance.
+           out        -- Preallocated (N,3) array for the redshift-space
+                         positions. (Default = None, allocate new array).
+           redshifts  -- Preallocated (N,) array for the observed
+                         redshifts. (Default = None, allocate new array).
+           chunksize  -- Number of objects processed at a time.
+                         (Default = 65536).
+           processes  -- Number of worker processes over which to
+                         distribute the chunks. (Default = None, run in
+                         this process).
+
+    Note: the observed redshift is z_obs = z + v_los*(1+z)/c, where z is
+          the cosmological redshift and v_los the line-of-sight velocity.
+          Redshift-space positions lie along the line of sight at the
+          comoving distance of z_obs. Inputs and outputs may be numpy
+          memmaps; only a bounded number of chunks is held in memory.
+          The conversions use the interpolation tables when the
+          cosmology has backend='table', which is much faster than the
+          machine-precision 'analytic' backend for large catalogs.
+          Worker processes receive a pickled copy of the cosmology,
+          including its tables, once at start-up.
+
+    """
+    funcname = sys._getframe().f_code.co_name
+    n = len(positions)
+    if np.shape(positions) != (n,3) or np.shape(velocities) != (n,3):
+        raise ValueError(funcname+"(): positions and velocities must both have shape (N,3).")
+    if out is None:
+        out = np.empty((n,3))
+    if redshifts is None:
+        redshifts = np.empty(n)
+    if np.shape(out) != (n,3) or np.shape(redshifts) != (n,):
+        raise ValueError(funcname+"(): output arrays must have shapes ("+str(n)+",3) and ("+str(n)+",).")
+    chunks = [slice(start,start+chunksize) for start in range(0,n,chunksize)]
+    if processes is None or processes <= 1:
+        for sl in chunks:
+            out[sl],redshifts[sl] = _redshiftSpaceKernel(cosmology,positions[sl],velocities[sl])
+        return out,redshifts
+    import multiprocessing
+    with multiprocessing.Pool(processes,initializer=_redshiftSpaceInit,initargs=(cosmology,)) as pool:
+        # Submit a few chunks per worker at a time so that memory use stays
+        # bounded for memory-mapped inputs
+        batch = 4*processes
+        for i in range(0,len(chunks),batch):
+            slices = chunks[i:i+batch]
+            args = [(positions[sl],velocities[sl]) for sl in slices]
+            for sl,(pos,zobs) in zip(slices,pool.imap(_redshiftSpaceChunk,args)):
+                out[sl] = pos
+                redshifts[sl] = zobs
+    return out,redshifts
+
+
+
+# Registry of quantities for adjustHubble(). Each entry maps a glob
+# pattern (matched against the lower-cased datatype) to the quantity name,
+# its h-exponent and whether it is logarithmic (a magnitude). Values in
+# units with h-exponent e scale as (hIn/hOut)**e; magnitudes, which are
+# -2.5log10 of a luminosity, shift additively by -2.5*e*log10(hIn/hOut).
+hubbleUnits = OrderedDict([("mag*",("magnitude",-2,True)),
+                           ("lum*",("luminosity",-2,False)),
+                           ("dis*",("distance",1,False)),
+                           ("vol*",("volume",3,False)),
+                           ("mass*",("mass",1,False)),
+                           ("den*",("density",-3,False))])
+_hubbleUnitLookup = {}
+
+def registerHubbleUnit(name,exponent,pattern=None,magnitude=False):
+    """
+    registerHubbleUnit(): Add a quantity to the registry used by
+                          adjustHubble().
+
+    USAGE: registerHubbleUnit(name,exponent,[pattern],[magnitude])
+
+           name      -- Name of the quantity, e.g. 'sfr'.
+           exponent  -- Power to which (hIn/hOut) is raised when converting
+                        values, e.g. 1 for Mpc/h, -2 for h^2 Lsun.
+           pattern   -- Glob pattern matched against datatype names.
+                        (Default = None, use name).
+           magnitude -- Quantity is a magnitude of a quantity with the
+                        given exponent. (Default = False).
+
+    """
+    if pattern is None:
+        pattern = name
+    hubbleUnits[pattern.lower()] = (name.lower(),exponent,magnitude)
+    _hubbleUnitLookup.clear()
+    return
+
+def hubbleUnit(datatype):
+    """
+    hubbleUnit(): Return the (name,exponent,magnitude) registry entry for
+                  the specified datatype. Lookups are cached, so repeated
+                  conversions do not re-parse the datatype string.
+
+    USAGE: name,exponent,magnitude = hubbleUnit(datatype)
+
+    """
+    funcname = sys._getframe().f_code.co_name
+    try:
+        return _hubbleUnitLookup[datatype]
+    except KeyError:
+        pass
+    matches = [unit for unit in hubbleUnits.values() if unit[0] == datatype.lower()]
+    matches += [unit for pattern,unit in hubbleUnits.items() \
+                    if fnmatch.fnmatch(datatype.lower(),pattern)]
+    if len(matches) > 0:
+        _hubbleUnitLookup[datatype] = matches[0]
+        return matches[0]
+    availableTypes = [unit[0] for unit in hubbleUnits.values()]
+    report = funcname+"(): Specified type '"+datatype+"' not recognised!\n"
+    report = report + "      Available datatypes are: "+", ".join(availableTypes)
+    raise ValueError(report)
+
 
 def adjustHubble(values,hIn,hOut,datatype,verbose=False):
-    funcname = sys._getframe().f_code.co_name    
-    # Get type of data to convert
-    if fnmatch.fnmatch(datatype.lower(),"mag*"):
-        dtype = "magnitude"
-        result = values - 5.0*np.log10(hOut/hIn)
-    elif fnmatch.fnmatch(datatype.lower(),"lum*"):
-        dtype = "luminosity"
-        result = values * ((hOut/hIn)**2)
-    elif fnmatch.fnmatch(datatype.lower(),"dis*"):
-        dtype = "distance"
-        result = values * (hIn/hOut)
-    elif fnmatch.fnmatch(datatype.lower(),"vol*"):
-        dtype = "volume"
-        result = values * ((hIn/hOut)**3)
-    elif fnmatch.fnmatch(datatype.lower(),"mass*"):
-        dtype = "mass"
-        result = values * (hIn/hOut)
-    elif fnmatch.fnmatch(datatype.lower(),"den*"):
-        dtype = "density"
-        result = values * ((hOut/hIn)**3)
-    else:
-        availableTypes = ["magnitude","luminosity","distance","volume","mass","density"]
-        report = funcname+"(): Specified type not recognised!\n"
-        report = report = "      Available datatypes are: "+", ".join(availableTypes)
-        raise ValueError(report)
+    """
+    adjustHubble(): Convert values from Hubble parameter hIn to hOut.
+
+    USAGE: result = adjustHubble(values,hIn,hOut,datatype,[verbose])
+
+           values   -- Values to convert. May be a numpy structured array,
+                       in which case datatype must be a dictionary and
+                       the array is converted in place.
+           datatype -- Type of quantity (see hubbleUnits and
+                       registerHubbleUnit()) or its h-exponent. For a
+                       structured array, a dictionary mapping field names
+                       to types; fields not in the dictionary are left
+                       unchanged. Fields that are converted must be
+                       floating point (a ValueError is raised otherwise).
+
+    """
+    funcname = sys._getframe().f_code.co_name
+    if isinstance(datatype,dict):
+        names = getattr(getattr(values,"dtype",None),"names",None)
+        if names is None:
+            raise ValueError(funcname+"(): a dictionary of datatypes requires a structured array.")
+        missing = [name for name in datatype.keys() if name not in names]
+        if len(missing) > 0:
+            raise KeyError(funcname+"(): fields not found in array: "+", ".join(missing))
+        integer = [name for name in datatype.keys() if not np.issubdtype(values.dtype[name],np.floating)]
+        if len(integer) > 0:
+            raise ValueError(funcname+"(): fields must be floating point to be converted in place: "+\
+                                 ", ".join(integer))
+        for name,dtype in datatype.items():
+            exponent,magnitude = _hubbleConversion(dtype)
+            _applyHubble(values[name],hIn,hOut,exponent,magnitude,out=values[name])
+        if verbose:
+            print(funcname+"(): Converted "+str(len(datatype))+" fields from h="+str(hIn)+" to h="+str(hOut))
+        return values
+    exponent,magnitude = _hubbleConversion(datatype)
+    result = _applyHubble(values,hIn,hOut,exponent,magnitude)
     if verbose:
-        print(funcname+"(): Converted "+dtype+" from h="+str(hIn)+" to h="+str(hOut))    
+        print(funcname+"(): Converted "+str(datatype)+" from h="+str(hIn)+" to h="+str(hOut))
     return result
+
+def _hubbleConversion(datatype):
+    if isinstance(datatype,str):
+        return hubbleUnit(datatype)[1:]
+    return datatype,False
+
+def _applyHubble(values,hIn,hOut,exponent,magnitude,out=None):
+    if magnitude:
+        shift = -2.5*exponent*np.log10(hIn/hOut)
+        if out is None:
+            return values + shift
+        return np.add(values,shift,out=out)
+    factor = (hIn/hOut)**exponent
+    if out is None:
+        return values * factor
+    return np.multiply(values,factor,out=out)
         
 
 def wavelengthToRedshift(obsv,emit):
@@ -488,7 +2215,7 @@ def redshiftToWavelength(z,emit):
     return (1.0+z)*emit
 
 def MpcToCM(r):
-    return r*Parsec*mega*100.0
+    return r*Parsec*constants.mega*100.0
 
 
 
@@ -4,6 +4,8 @@ import sys,os
 import h5py
 import numpy as np
 import fnmatch
+import functools
+import glob
 import unittest
 
 def flattenNestedList(l):
@@ -17,6 +19,10 @@ def findMissingItems(allItems,itemsToSearch):
     missing = [len(fnmatch.filter(allItems,item))==0 for item in itemsToSearch]
     return [item for item, miss in zip(itemsToSearch, missing) if miss]
 
+# Comparison operators allowed in the 'where' option of HDF5.readDatasets()
+whereOperators = {"<":np.less,"<=":np.less_equal,">":np.greater,">=":np.greater_equal,\
+                      "==":np.equal,"!=":np.not_equal}
+
 def readonlyWrapper(func):
     """
     Wrapper to check whether HDF5 file has been opened in read-only mode.    
@@ -28,6 +34,36 @@ def readonlyWrapper(func):
         return func(self,*args,**kwargs)
     return wrapper
 
+def indexWrapper(func):
+    """
+    Wrapper to invalidate the metadata index of an HDF5 file if a function
+    that modifies the file fails part way through. (On success the function
+    updates the affected index entries itself.)
+    """
+    @functools.wraps(func)
+    def wrapper(self,*args,**kwargs):
+        try:
+            return func(self,*args,**kwargs)
+        except:
+            self.invalidateIndex()
+            raise
+    return wrapper
+
+def normalizePath(path):
+    """
+    Return HDF5 path in the form '/group/name' (or '/' for the root group).
+    """
+    return "/"+"/".join([item for item in str(path).split("/") if item != ""])
+
+def indexEntry(obj):
+    """
+    Return the metadata index entry for an h5py group or dataset.
+    """
+    if isinstance(obj,h5py.Dataset):
+        return {"kind":"dataset","shape":obj.shape,"dtype":obj.dtype,\
+                    "size":obj.size,"chunks":obj.chunks}
+    return {"kind":"group"}
+
 
 class HDF5(object):
     """ 
@@ -71,6 +107,7 @@ class HDF5(object):
                 print(classname+"(): HDF5 opened in READ-ONLY mode")
         elif self.fileObj.mode == "r+":
             self.read_only = False
+        self._groups = {}
         return
     
     def close(self):
@@ -83,6 +120,114 @@ class HDF5(object):
         self.fileObj.close()
         return
 
+    def index(self):
+        """
+        HDF5.index(): Return the metadata index of the HDF5 file.
+
+        USAGE:  index = HDF5.index()
+
+            OUTPUTS
+                 index -- Dictionary mapping the path of every group and dataset
+                          (e.g. '/Data/ExampleFloatData') to a dictionary with
+                          its 'kind' ('group' or 'dataset') and, for datasets,
+                          its 'shape', 'dtype', 'size' and 'chunks'.
+
+        Note: the index is held per group. The members of a group are listed
+              once, on first access to the group, and are used for all
+              existence and size checks. The HDF5 class methods that modify
+              the file update the affected entries; call invalidateIndex()
+              after modifying the file through fileObj. This function lists
+              every group in the file.
+
+        """
+        index = {"/":{"kind":"group"}}
+        groups = ["/"]
+        while len(groups) > 0:
+            group = groups.pop(0)
+            for name,entry in self._members(group).items():
+                path = (group+"/"+name).replace("//","/")
+                index[path] = entry
+                if entry["kind"] == "group":
+                    groups.append(path)
+        return index
+
+    def invalidateIndex(self):
+        """
+        HDF5.invalidateIndex(): Discard the metadata index so that it is rebuilt
+                                on next use.
+
+        USAGE:  HDF5.invalidateIndex()
+
+        """
+        self._groups = {}
+        return
+
+    def _members(self,hdfdir):
+        """
+        HDF5._members(): Return the index entries of the members of a group,
+                         keyed by name (or None if there is no such group).
+                         Soft and external links are not indexed.
+        """
+        path = normalizePath(hdfdir)
+        if path not in self._groups:
+            if path not in self.fileObj:
+                return None
+            g = self.fileObj[path]
+            if not isinstance(g,h5py.Group):
+                return None
+            members = {}
+            for name in g.keys():
+                if isinstance(g.get(name,getlink=True),h5py.HardLink):
+                    members[name] = indexEntry(g[name])
+            self._groups[path] = members
+        return self._groups[path]
+
+    def _updateIndex(self,hdfPath):
+        """
+        HDF5._updateIndex(): Update the index entries of an object (and of its
+                             parent groups) after it has been created, modified
+                             or removed.
+        """
+        path = normalizePath(hdfPath)
+        # Forget the members of the object and of any groups below it
+        prefix = path.rstrip("/")+"/"
+        for group in [group for group in self._groups.keys() if group == path or group.startswith(prefix)]:
+            del self._groups[group]
+        # Refresh the entry of the object and of each parent group
+        while path != "/":
+            parent,name = path.rsplit("/",1)
+            parent = parent or "/"
+            if parent in self._groups:
+                members = self._groups[parent]
+                link = self.fileObj[parent].get(name,getlink=True)
+                if isinstance(link,h5py.HardLink):
+                    members[name] = indexEntry(self.fileObj[path])
+                else:
+                    members.pop(name,None)
+            path = parent
+        return
+
+    def _lookup(self,hdfPath,kind=None):
+        """
+        HDF5._lookup(): Return the index entry for path (or None if there is
+                        no such object, or it is not of the specified kind).
+        """
+        path = normalizePath(hdfPath)
+        if path == "/":
+            entry = {"kind":"group"}
+        else:
+            parent,name = path.rsplit("/",1)
+            members = self._members(parent or "/")
+            entry = None
+            if members is not None:
+                entry = members.get(name)
+        if entry is None and path in self.fileObj:
+            # Soft and external links are not indexed
+            entry = indexEntry(self.fileObj[path])
+        if entry is None or (kind is not None and entry["kind"] != kind):
+            return None
+        return entry
+
     def lsObjects(self,hdfdir,recursive=False):
         """
         HDF5.lsObjects(): List all of the objects in the specified directory 
@@ -116,6 +261,7 @@ class HDF5(object):
     ##############################################################################
     
     @readonlyWrapper
+    @indexWrapper
     def mkGroup(self,hdfdir):        
         """
         HDF5.mkGroup(): create HDF5 group with specified path.
@@ -126,10 +272,12 @@ class HDF5(object):
         """
         if hdfdir not in self.fileObj:
             g = self.fileObj.create_group(hdfdir)
+            self._updateIndex(hdfdir)
         return
 
     
     @readonlyWrapper
+    @indexWrapper
     def rmGroup(self,hdfdir):
         """
         HDF5.rmGroup(): remove HDF5 group at specified path.
@@ -140,10 +288,12 @@ class HDF5(object):
         """
         if hdfdir in self.fileObj:
             del self.fileObj[hdfdir]
+            self._updateIndex(hdfdir)
         return
 
 
     @readonlyWrapper
+    @indexWrapper
     def cpGroup(self,srcfile,srcdir,dstdir=None):        
         """
         HDF5.cpGroup(): copy HDF5 group with specified path from specified file.
@@ -170,6 +320,7 @@ class HDF5(object):
             dstdir = srcdir
         fileObj.copy(srcdir,group_id,name=dstdir)
         fileObj.close()   
+        self._updateIndex(group_id[dstdir].name)
         return
     
     def lsGroups(self,hdfdir,recursive=False):
@@ -193,11 +344,12 @@ class HDF5(object):
 
 
     @readonlyWrapper
+    @indexWrapper
     def writeDataset(self,hdfdir,name,data,maxshape=tuple([None]),overwrite=False,\
                          chunks=True,compression="gzip",compression_opts=6,**kwargs):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
         # Select HDF5 group
-        if hdfdir not in self.fileObj.keys():
+        if hdfdir not in self.fileObj:
             self.mkGroup(hdfdir)
         g = self.fileObj[hdfdir]
         # Check if dataset exists
@@ -211,9 +363,11 @@ class HDF5(object):
         dset = g.create_dataset(name,data=data,maxshape=maxshape,\
                                     chunks=chunks,compression=compression,\
                                     compression_opts=compression_opts,**kwargs)
+        self._updateIndex(dset.name)
         return
 
     @readonlyWrapper
+    @indexWrapper
     def appendDataset(self,hdfdir,name,data,exit_if_missing=False,\
                           axis=0,maxshape=tuple([None]),chunks=True,\
                           compression="gzip",compression_opts=6,**kwargs):
@@ -231,6 +385,7 @@ class HDF5(object):
         n = dset.shape[axis]
         dset.resize(dset.shape[axis]+data.shape[axis],axis=axis) 
         dset[n:] = np.copy(data)    
+        self._updateIndex(dset.name)
         return
         
     @readonlyWrapper
@@ -239,7 +394,7 @@ class HDF5(object):
                         compression_opts=6,**kwargs):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
         # Select HDF5 group
-        if hdfdir not in self.fileObj.keys():
+        if hdfdir not in self.fileObj:
             self.mkGroup(hdfdir)
         # Write dataset
         if append:
@@ -261,7 +416,7 @@ class HDF5(object):
                         compression_opts=6,**kwargs):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
         # Select HDF5 group
-        if hdfdir not in self.fileObj.keys():
+        if hdfdir not in self.fileObj:
             self.mkGroup(hdfdir)
         # Write data to group
         dummy = [ self.addDataset(hdfdir,n,data[n],append=append,overwrite=overwrite,\
@@ -272,34 +427,37 @@ class HDF5(object):
         return
 
     @readonlyWrapper
+    @indexWrapper
     def rmDataset(self,hdfdir,dataset):
         if hdfdir in self.fileObj:
             g = self.fileObj[hdfdir]
-            if dataset in g.keys():
+            if dataset in g:
                 del g[dataset]
+                self._updateIndex(hdfdir+"/"+dataset)
         return
 
     def lsDatasets(self,hdfdir,recursive=False):
+        thisdir = normalizePath(hdfdir)
+        members = self._members(thisdir)
+        if members is None:
+            # Raise the usual error for a missing group
+            self.fileObj[hdfdir]
         ls = []
-        thisdir = self.fileObj[hdfdir]
-        for obj in thisdir.keys():            
-            if isinstance(thisdir[obj],h5py.Group) and recursive:
-                path = hdfdir+"/"+str(obj)
-                path = path.replace("//","/")
+        for obj,entry in members.items():
+            path = (thisdir+"/"+obj).replace("//","/")
+            if entry["kind"] == "group" and recursive:
                 ls = ls + self.lsDatasets(path+"/",recursive=recursive)
-            if isinstance(thisdir[obj],h5py.Dataset):
+            if entry["kind"] == "dataset":
                 if recursive:
-                    path = hdfdir+"/"+str(obj)
-                    path = path.replace("//","/")
                     ls.append(path)
                 else:
-                    ls.append(str(obj))
+                    ls.append(obj)
         return ls
     
     def findMatchingDatasets(self,hdfdir,searchItems,recursive=False,exit_if_missing=True):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
         if recursive:
-            objs = self.lsGroup(hdfdir,recursive=recursive)                     
+            objs = self.lsDatasets(hdfdir,recursive=recursive)
         else:
             objs = self.lsDatasets(hdfdir)           
         matches = findMatchingItems(objs,searchItems)        
@@ -316,15 +474,15 @@ class HDF5(object):
     
     def datasetExists(self,hdfdir,name,exit_if_missing=True):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
-        exists = name in self.lsDatasets(hdfdir)
+        exists = self._lookup(hdfdir+"/"+name,kind="dataset") is not None
         if not exists and exit_if_missing:
             raise KeyError(funcname+"(): dataset '"+name+"' not found in "+hdfdir+"!")
         return exists
 
     def readDataset(self,hdfPath,exit_if_missing=True):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
-        name = hdfPath.split("/")[-1]
-        hdfdir = hdfPath.replace(name,"")
+        hdfdir,name = normalizePath(hdfPath).rsplit("/",1)
+        hdfdir = hdfdir or "/"
         if hdfdir not in self.fileObj:
             raise KeyError(funcname+"(): "+hdfdir+" not found in HDF5 file!")        
         data = None
@@ -340,62 +498,394 @@ class HDF5(object):
         return
 
     def buildDataType(self,hdfdir,names):
-        dtype = [(name,str(self.fileObj[hdfdir+"/"+name].dtype)) for name in names]
+        dtype = [(name,str(self._lookup(hdfdir+"/"+name)["dtype"])) for name in names]
         return dtype
 
     def datasetSize(self,hdfPath,exit_if_missing=True):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
-        name = hdfPath.split("/")[-1]
-        hdfdir = hdfPath.replace(name,"")
+        hdfdir,name = normalizePath(hdfPath).rsplit("/",1)
+        hdfdir = hdfdir or "/"
         size = 0
         if self.datasetExists(hdfdir,name,exit_if_missing=exit_if_missing):
-            size = self.fileObj[hdfPath].size
+            size = self._lookup(hdfPath)["size"]
         return size
             
-    def readDatasets(self,hdfdir,recursive=False,required=None,exit_if_missing=True):
+    def readColumn(self,hdfPath,out,chunksize=65536):
+        """
+        readColumn(): Read an HDF5 dataset directly into a preallocated array.
+
+        USAGE:   HDF5().readColumn(hdfPath,out,[chunksize])
+
+        Inputs:
+               hdfPath : Path to dataset.
+               out : Array with the shape of the dataset. May be a strided
+                     view, e.g. a field of a numpy structured array.
+               chunksize : Number of rows read at a time when out is not
+                           contiguous. (Default = 65536).
+
+        Note: contiguous arrays are filled with h5py read_direct, with no
+              temporary arrays. Strided arrays are filled through a small
+              buffer, chunksize rows at a time, which stays in cache. (This is
+              much faster than a strided HDF5 memory selection, which
+              HDF5 scatters one element at a time.)
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        dset = self.fileObj[hdfPath]
+        if out.shape != dset.shape:
+            raise ValueError(funcname+"(): shape of output "+str(out.shape)+\
+                                 " does not match dataset "+str(dset.shape)+"!")
+        if out.size == 0:
+            return out
+        if out.flags["C_CONTIGUOUS"]:
+            dset.read_direct(out)
+            return out
+        n = dset.shape[0]
+        chunksize = min(chunksize,n)
+        buffer = np.empty((chunksize,)+dset.shape[1:],dtype=out.dtype)
+        for start in range(0,n,chunksize):
+            stop = min(start+chunksize,n)
+            dset.read_direct(buffer,np.s_[start:stop],np.s_[0:stop-start])
+            out[start:stop] = buffer[:stop-start]
+        return out
+
+    def readRows(self,hdfPath,rows,out=None,blocksize=None):
+        """
+        readRows(): Read selected rows of an HDF5 dataset.
+
+        USAGE:   data = HDF5().readRows(hdfPath,rows,[out],[blocksize])
+
+        Inputs:
+               hdfPath : Path to dataset.
+               rows : Array of indices of the rows to read.
+               out : Array in which to store the rows. (Default = None, i.e.
+                     allocate a new array).
+               blocksize : Number of dataset rows per block. (Default = None,
+                           i.e. use blockSize() to match the HDF5 chunks).
+
+        Outputs:
+               data : Numpy array of the selected rows (in the order of rows).
+
+        Note: the rows are read a block at a time. Rows that form a single
+              contiguous run in a block are read straight into the output;
+              otherwise the span of the block containing the rows is read
+              with one hyperslab selection and the rows are taken from it.
+              At most one block of the dataset is held in memory.
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        dset = self.fileObj[hdfPath]
+        rows = np.asarray(rows,dtype=np.int64).ravel()
+        shape = (len(rows),)+dset.shape[1:]
+        if out is None:
+            out = np.empty(shape,dtype=dset.dtype)
+        if out.shape != shape:
+            raise ValueError(funcname+"(): shape of output "+str(out.shape)+\
+                                 " does not match selection "+str(shape)+"!")
+        if len(rows) == 0:
+            return out
+        if np.any(rows[1:] < rows[:-1]):
+            # Read the rows in order and reorder afterwards
+            order = np.argsort(rows,kind="stable")
+            out[order] = self.readRows(hdfPath,rows[order],blocksize=blocksize)
+            return out
+        if rows[0] < 0 or rows[-1] >= dset.shape[0]:
+            raise ValueError(funcname+"(): row indices out of range for dataset with "+\
+                                 str(dset.shape[0])+" rows!")
+        if blocksize is None:
+            blocksize = self.blockSize([hdfPath])
+        blocks = rows//blocksize
+        edges = np.concatenate(([0],np.flatnonzero(blocks[1:] != blocks[:-1])+1,[len(rows)]))
+        buffer = None
+        for i,j in zip(edges[:-1],edges[1:]):
+            first = rows[i]
+            last = rows[j-1] + 1
+            if last-first == j-i and np.all(rows[i+1:j]-rows[i:j-1] == 1):
+                if out.flags["C_CONTIGUOUS"]:
+                    dset.read_direct(out,np.s_[first:last],np.s_[i:j])
+                else:
+                    out[i:j] = dset[first:last]
+                continue
+            if buffer is None:
+                buffer = np.empty((min(blocksize,dset.shape[0]),)+dset.shape[1:],dtype=dset.dtype)
+            dset.read_direct(buffer,np.s_[first:last],np.s_[0:last-first])
+            out[i:j] = buffer[rows[i:j]-first]
+        return out
+
+    def selectRows(self,hdfdir,where,blocksize=None):
+        """
+        selectRows(): Return the indices of the rows in an HDF5 group that satisfy
+                      a set of conditions.
+
+        USAGE:   rows = HDF5().selectRows(hdfdir,where,[blocksize])
+
+        Inputs:
+               hdfdir : Path to group of datasets.
+               where : List of conditions (name,operator,value), e.g.
+                       [("mass",">",1.0e11),("z","<",1.0)], all of which must be
+                       satisfied. Allowed operators are the keys of whereOperators.
+                       An empty list selects all rows.
+               blocksize : Number of rows per block. (Default = None, i.e. use
+                           blockSize() to match the HDF5 chunks).
+
+        Outputs:
+               rows : Sorted array of indices of the selected rows.
+
+        Note: only the datasets named in the conditions are read, one block
+              at a time (see iterDatasets()).
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        for name,op,value in where:
+            if op not in whereOperators.keys():
+                raise ValueError(funcname+"(): operator '"+str(op)+"' not recognised! "+\
+                                     "Allowed operators are: "+", ".join(whereOperators.keys()))
+            self.datasetExists(hdfdir,name,exit_if_missing=True)
+        if len(where) == 0:
+            return np.arange(self.datasetSize(hdfdir+"/"+self.lsDatasets(hdfdir)[0]))
+        names = list(set([name for name,op,value in where]))
+        selected = [np.zeros(0,dtype=np.int64)]
+        start = 0
+        for block in self.iterDatasets(hdfdir,required=names,blocksize=blocksize,columnar=True):
+            mask = np.ones(len(block[names[0]]),dtype=bool)
+            for name,op,value in where:
+                mask &= whereOperators[op](block[name],value)
+            selected.append(np.flatnonzero(mask)+start)
+            start += len(mask)
+        return np.concatenate(selected)
+
+    def _rowSelection(self,hdfdir,where,rows,n):
+        """
+        _rowSelection(): Return the indices of the rows to read from datasets
+                         with n rows given the 'where' and 'rows' options of
+                         readDatasets().
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        if rows is not None:
+            rows = np.asarray(rows)
+            if rows.dtype == bool:
+                if rows.shape != (n,):
+                    raise ValueError(funcname+"(): boolean row mask has shape "+str(rows.shape)+\
+                                         ", expected "+str((n,))+"!")
+                rows = np.flatnonzero(rows)
+            else:
+                rows = rows.astype(np.int64).ravel()
+                rows = np.where(rows < 0,rows+n,rows)
+        if where is None or len(where) == 0:
+            return rows
+        selected = self.selectRows(hdfdir,where)
+        if rows is None:
+            return selected
+        return rows[np.isin(rows,selected)]
+
+    def readDatasets(self,hdfdir,recursive=False,required=None,exit_if_missing=True,\
+                         columnar=False,where=None,rows=None):
         """
         readDatasets(): Read one or more HDF5 datasets.
 
-        USAGE:   data = HDF5().readDatasets(hdfdir,[recursive],[required],[exist_if_missing])
+        USAGE:   data = HDF5().readDatasets(hdfdir,[recursive],[required],[exist_if_missing],
+                                            [columnar],[where],[rows])
         
         Inputs:
                hdfdir : Path to dataset or group of datasets to read.
                recursive : If reading HDF5 group, read recursively down subgroups. 
-                           (Default = False)
+                           Datasets in subgroups are named by their path relative
+                           to hdfdir, e.g. 'subgroup/name'. (Default = False)
                required : List of names of datasets to read. If required=None, will read
                           all datasets. (Default = None).
                exit_if_missing : Will raise error and exit if any of names in 'required'
                                  are missing. (Default = True).
+               columnar : If reading HDF5 group, return a dictionary of contiguous
+                          arrays (one per dataset) instead of a structured array.
+                          (Default = False).
+               where : List of conditions (name,operator,value) on datasets in the
+                       group (or, if reading a single dataset, in its parent group)
+                       that the rows to read must satisfy, e.g. [("mass",">",1.0e11)].
+                       An empty list applies no conditions. (Default = None).
+               rows : Indices (or boolean mask) of the rows to read. If used with
+                      where, the rows that also satisfy the conditions are read.
+                      (Default = None).
         
         Outputs:
-               data : Numpy array of datasets.
+               data : Numpy array of datasets (or dictionary of arrays if columnar=True).
+
+        Note: the output is allocated once and each dataset is read directly into
+              it (see readColumn()). With where/rows, the conditions are evaluated
+              block by block and only the selected rows are read (see selectRows()
+              and readRows()), so memory use scales with the selection.
 
         """
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
         if hdfdir not in self.fileObj:
             raise KeyError(funcname+"(): "+hdfdir+" not found in HDF5 file!")        
+        if where is not None and len(where) == 0:
+            where = None
+        select = where is not None or rows is not None
         if isinstance(self.fileObj[hdfdir],h5py.Dataset):            
             # Read single dataset
-            DATA = self.readDataset(hdfdir,exit_if_missing=exit_if_missing)
+            if not select:
+                DATA = self.readDataset(hdfdir,exit_if_missing=exit_if_missing)
+            else:
+                name = hdfdir.rstrip("/").split("/")[-1]
+                group = hdfdir.rstrip("/")[:-len(name)]
+                n = self._lookup(hdfdir)["shape"][0]
+                DATA = self.readRows(hdfdir,self._rowSelection(group,where,rows,n))
         elif isinstance(self.fileObj[hdfdir],h5py.Group):
             # Read datasets in group
-            # i) List datasets (recursively if specified)
-            if recursive:
-                objs = self.lsGroup(hdfdir,recursive=recursive)                     
-            else:
-                objs = self.lsDatasets(hdfdir)   
-            if required is not None:                
+            # i) List datasets (recursively if specified). Datasets in sub-groups
+            #    are named by their path relative to hdfdir.
+            prefix = normalizePath(hdfdir).rstrip("/")+"/"
+            if required is not None:
+                if recursive:
+                    required = [prefix+item.lstrip("/") for item in required]
                 objs = self.findMatchingDatasets(hdfdir,required,recursive=recursive,\
                                                     exit_if_missing=exit_if_missing)
+            else:
+                objs = self.lsDatasets(hdfdir,recursive=recursive)
+            if recursive:
+                objs = [obj[len(prefix):] for obj in objs]
+            n = self.datasetSize(hdfdir+"/"+objs[0])
+            selection = None
+            if select:
+                selection = self._rowSelection(hdfdir,where,rows,n)
+                n = len(selection)
+            if columnar:
+                # ii) Allocate and read each dataset into its own array
+                DATA = {}
+                for obj in objs:
+                    if selection is not None:
+                        DATA[obj] = self.readRows(hdfdir+"/"+obj,selection)
+                        continue
+                    dset = self.fileObj[hdfdir+"/"+obj]
+                    DATA[obj] = self.readColumn(hdfdir+"/"+obj,np.empty(dset.shape,dtype=dset.dtype))
+                return DATA
             # ii) Get datatypes
             dtype = self.buildDataType(hdfdir,objs)
             # iii) Initialize array
-            n = self.datasetSize(hdfdir+"/"+objs[0])
-            DATA = np.zeros(n,dtype=dtype)
-            # ii) Store datasets in array
-            dummy = [self.storeDataset(DATA,hdfdir,obj) for obj in objs]
+            DATA = np.empty(n,dtype=dtype)
+            # iv) Read datasets directly into array
+            for obj in objs:
+                if selection is not None:
+                    self.readRows(hdfdir+"/"+obj,selection,out=DATA[obj])
+                else:
+                    self.readColumn(hdfdir+"/"+obj,DATA[obj])
         return DATA
-                            
+
+    def blockSize(self,hdfPaths,maxsize=1048576):
+        """
+        blockSize(): Return the default number of rows per block when streaming
+                     the specified datasets.
+
+        USAGE:   n = HDF5().blockSize(hdfPaths,[maxsize])
+
+        Inputs:
+               hdfPaths : List of paths to datasets.
+               maxsize : Maximum number of rows per block. (Default = 1048576).
+
+        Outputs:
+               n : Least common multiple of the number of rows in the chunks
+                   of the (chunked) datasets, so that each HDF5 chunk is
+                   decompressed exactly once. If this exceeds maxsize, the
+                   largest chunk size is used instead. Contiguous datasets
+                   are read 65536 rows at a time.
+
+        """
+        rows = [self._lookup(path,kind="dataset")["chunks"] for path in hdfPaths]
+        rows = [chunks[0] for chunks in rows if chunks is not None]
+        if len(rows) == 0:
+            return 65536
+        n = int(np.lcm.reduce(rows))
+        if n > maxsize:
+            n = max(rows)
+        return n
+
+    def iterDatasets(self,hdfdir,required=None,exit_if_missing=True,blocksize=None,\
+                         columnar=False,readahead=False):
+        """
+        iterDatasets(): Iterate over one or more HDF5 datasets in blocks of rows.
+
+        USAGE:   for data in HDF5().iterDatasets(hdfdir,[required],[exit_if_missing],
+                                                 [blocksize],[columnar],[readahead]):
+                     ...
+
+        Inputs:
+               hdfdir : Path to dataset or group of datasets to read.
+               required : List of names (or glob patterns) of datasets to read. If
+                          required=None, will read all datasets. (Default = None).
+               exit_if_missing : Will raise error and exit if any of names in 'required'
+                                 are missing. (Default = True).
+               blocksize : Number of rows per block. (Default = None, i.e. use
+                           blockSize() to match the HDF5 chunks).
+               columnar : If reading HDF5 group, yield dictionaries of contiguous
+                          arrays (one per dataset) instead of structured arrays.
+                          (Default = False).
+               readahead : Read the next block on a background thread while the
+                           current block is being processed. (Default = False).
+
+        Yields:
+               data : Numpy array (or dictionary of arrays if columnar=True) with the
+                      same rows of each dataset. Every block is a new array, so
+                      blocks may be kept after the next one has been read.
+
+        Note: only one block (two if readahead=True) is held in memory at a time,
+              so groups larger than the available memory can be processed.
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        if hdfdir not in self.fileObj:
+            raise KeyError(funcname+"(): "+hdfdir+" not found in HDF5 file!")
+        single = isinstance(self.fileObj[hdfdir],h5py.Dataset)
+        if single:
+            objs = [hdfdir.rstrip("/").split("/")[-1]]
+            hdfdir = hdfdir.rstrip("/")[:-len(objs[0])]
+        elif required is not None:
+            objs = self.findMatchingDatasets(hdfdir,required,exit_if_missing=exit_if_missing)
+        else:
+            objs = self.lsDatasets(hdfdir)
+        if len(objs) == 0:
+            return
+        paths = [hdfdir+"/"+obj for obj in objs]
+        entries = [self._lookup(path,kind="dataset") for path in paths]
+        n = entries[0]["shape"][0]
+        for obj,entry in zip(objs,entries):
+            if entry["shape"][0] != n:
+                raise ValueError(funcname+"(): dataset '"+obj+"' has "+str(entry["shape"][0])+\
+                                     " rows, expected "+str(n)+"!")
+        if blocksize is None:
+            blocksize = self.blockSize(paths)
+        dsets = [self.fileObj[path] for path in paths]
+        dtype = [(obj,entry["dtype"],entry["shape"][1:]) for obj,entry in zip(objs,entries)]
+        def readBlock(start):
+            stop = min(start+blocksize,n)
+            columns = {}
+            for obj,dset in zip(objs,dsets):
+                columns[obj] = np.empty((stop-start,)+dset.shape[1:],dtype=dset.dtype)
+                if stop > start:
+                    dset.read_direct(columns[obj],np.s_[start:stop])
+            if single:
+                return columns[objs[0]]
+            if columnar:
+                return columns
+            DATA = np.empty(stop-start,dtype=dtype)
+            for obj in objs:
+                DATA[obj] = columns[obj]
+            return DATA
+        starts = range(0,n,blocksize)
+        if not readahead:
+            for start in starts:
+                yield readBlock(start)
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = None
+            for start in starts:
+                block = future.result() if future is not None else readBlock(start)
+                future = None
+                if start+blocksize < n:
+                    future = executor.submit(readBlock,start+blocksize)
+                yield block
+        return
+
     
     ##############################################################################
     # ATTRIBUTES
@@ -451,6 +941,314 @@ class HDF5(object):
         return
 
 
+def _multiColumns(buffer,spec,n,objs):
+    """
+    _multiColumns(): Return views of the column of each dataset in a buffer
+                     holding the output of MultiHDF5.readDatasets().
+    """
+    if isinstance(spec,np.dtype):
+        DATA = np.ndarray(n,dtype=spec,buffer=buffer)
+        return {obj:DATA[obj] for obj in objs}
+    return {obj:np.ndarray((n,)+spec[obj][1],dtype=spec[obj][0],buffer=buffer,offset=spec[obj][2]) \
+                for obj in objs}
+
+def _multiReadFile(buffer,job):
+    """
+    _multiReadFile(): Read the datasets in one file into its rows of the
+                      output of MultiHDF5.readDatasets().
+    """
+    filename,hdfdir,objs,spec,n,start,stop = job
+    columns = _multiColumns(buffer,spec,n,objs)
+    F = HDF5(filename,'r')
+    for obj in objs:
+        F.readColumn(hdfdir+"/"+obj,columns[obj][start:stop])
+    F.close()
+    return stop-start
+
+def _multiReadShared(args):
+    """
+    _multiReadShared(): Read one file into a shared memory output (worker for
+                        MultiHDF5.readDatasets()).
+    """
+    from multiprocessing import shared_memory
+    shmname,job = args
+    shm = shared_memory.SharedMemory(name=shmname)
+    try:
+        rows = _multiReadFile(shm.buf,job)
+    finally:
+        shm.close()
+    return rows
+
+
+def _multiCloseShared(shm):
+    """
+    _multiCloseShared(): Close a shared memory output of MultiHDF5.readDatasets()
+                         once the arrays viewing it have been collected.
+    """
+    try:
+        shm.close()
+    except BufferError:
+        # Arrays still alive at interpreter exit: the mapping is released
+        # with the process.
+        pass
+    return
+
+
+class MultiHDF5(object):
+    """
+    MultiHDF5: Class for reading datasets split across several HDF5 files
+               (e.g. one file per MPI rank). Groups with the same path in
+               each file are presented as a single table, with the rows of
+               each file concatenated in file order.
+
+          USAGE: OBJ = MultiHDF5(files,[processes=<processes>],[verbose=<verbose>])
+
+          INPUTS
+                 files -- Glob pattern (e.g. 'galacticus_*.hdf5') or list of
+                          paths to HDF5 files. Files matching a pattern are
+                          sorted by name.
+             processes -- Number of worker processes over which to distribute
+                          the files when reading. (Default = None, read in this
+                          process).
+               verbose -- Print extra information (default value = False).
+
+          OUTPUTS
+                OBJ  -- MultiHDF5 class object.
+
+    Attributes:
+         files: List of HDF5 file paths.
+         processes: Number of worker processes used by readDatasets().
+
+    """
+    def __init__(self,files,processes=None,verbose=False):
+        classname = self.__class__.__name__
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        if isinstance(files,str):
+            files = sorted(glob.glob(files))
+        self.files = list(files)
+        if len(self.files) == 0:
+            raise IOError(funcname+"(): no HDF5 files found!")
+        self.processes = processes
+        self.verbose = verbose
+        self._indices = None
+        self._groups = {}
+        if self.verbose:
+            print(classname+"(): "+str(len(self.files))+" HDF5 files")
+        return
+
+    def indices(self):
+        """
+        MultiHDF5.indices(): Return the metadata index (see HDF5.index()) of
+                             each file.
+
+        USAGE:  indices = MultiHDF5.indices()
+
+        """
+        if self._indices is None:
+            indices = []
+            for filename in self.files:
+                F = HDF5(filename,'r')
+                indices.append(F.index())
+                F.close()
+            self._indices = indices
+        return self._indices
+
+    def _members(self,hdfdir):
+        """
+        MultiHDF5._members(): Return, for each file, the index entries of the
+                              members of a group (or None if the file has no
+                              such group). See HDF5._members().
+        """
+        path = normalizePath(hdfdir)
+        if path not in self._groups:
+            members = []
+            for filename in self.files:
+                F = HDF5(filename,'r')
+                members.append(F._members(path))
+                F.close()
+            self._groups[path] = members
+        return self._groups[path]
+
+    def lsDatasets(self,hdfdir):
+        """
+        MultiHDF5.lsDatasets(): List the datasets in a group (in the first file
+                                in which the group contains datasets).
+
+        USAGE:  objs = MultiHDF5.lsDatasets(dir)
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        found = False
+        for members in self._members(hdfdir):
+            if members is None:
+                continue
+            found = True
+            ls = [name for name,entry in members.items() if entry["kind"] == "dataset"]
+            if len(ls) > 0:
+                return ls
+        if not found:
+            raise KeyError(funcname+"(): "+hdfdir+" not found in HDF5 files!")
+        return []
+
+    def findMatchingDatasets(self,hdfdir,searchItems,exit_if_missing=True):
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        matches = findMatchingItems(self.lsDatasets(hdfdir),searchItems)
+        if exit_if_missing:
+            missing = findMissingItems(matches,searchItems)
+            if len(missing) > 0:
+                raise KeyError(funcname+"(): Some required keys cannot be found in '"+hdfdir+\
+                                   "': "+", ".join(missing))
+        return matches
+
+    def rowOffsets(self,hdfdir,objs):
+        """
+        MultiHDF5.rowOffsets(): Return the offset of the rows of each file in
+                                the concatenated table.
+
+        USAGE:  offsets = MultiHDF5.rowOffsets(dir,objs)
+
+             INPUTS
+                   dir     -- Path to HDF5 group.
+                   objs    -- List of dataset names.
+
+            OUTPUTS
+                   offsets -- Array of length len(files)+1. The rows of file i
+                              are rows offsets[i]:offsets[i+1] of the table.
+
+        Note: files in which the group is missing or contains no datasets
+              contribute no rows. Otherwise each dataset must be present, with
+              the same number of rows as the other datasets in the file.
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        counts = np.zeros(len(self.files),dtype=np.int64)
+        for i,members in enumerate(self._members(hdfdir)):
+            if members is None or len(members) == 0:
+                continue
+            entries = [members.get(obj) for obj in objs]
+            for obj,entry in zip(objs,entries):
+                if entry is None or entry["kind"] != "dataset":
+                    raise KeyError(funcname+"(): dataset '"+obj+"' not found in "+hdfdir+\
+                                       " in "+self.files[i]+"!")
+                if entry["shape"][0] != entries[0]["shape"][0]:
+                    raise ValueError(funcname+"(): datasets in "+hdfdir+" in "+self.files[i]+\
+                                         " have different numbers of rows!")
+            counts[i] = entries[0]["shape"][0]
+        return np.concatenate(([0],np.cumsum(counts)))
+
+    def datasetSize(self,hdfPath):
+        name = hdfPath.rstrip("/").split("/")[-1]
+        hdfdir = hdfPath.rstrip("/")[:-len(name)]
+        return int(self.rowOffsets(hdfdir,[name])[-1])
+
+    def _columnSpec(self,hdfdir,objs,offsets,columnar):
+        """
+        _columnSpec(): Return the layout of the output of readDatasets() and
+                       its size in bytes.
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        n = int(offsets[-1])
+        columns = {}
+        for i,members in enumerate(self._members(hdfdir)):
+            if offsets[i+1] == offsets[i]:
+                continue
+            for obj in objs:
+                column = (members[obj]["dtype"],members[obj]["shape"][1:])
+                if columns.setdefault(obj,column) != column:
+                    raise ValueError(funcname+"(): dataset '"+obj+"' in "+self.files[i]+\
+                                         " has a different type or shape to other files!")
+        if not columnar:
+            spec = np.dtype([(obj,)+columns[obj] for obj in objs])
+            return spec,n*spec.itemsize
+        # Columns are stored one after another, aligned to 64 bytes
+        spec = {}
+        nbytes = 0
+        for obj in objs:
+            dtype,shape = columns[obj]
+            spec[obj] = (dtype,shape,nbytes)
+            nbytes += -(-n*int(np.prod(shape))*dtype.itemsize//64)*64
+        return spec,nbytes
+
+    def readDatasets(self,hdfdir,required=None,exit_if_missing=True,columnar=False):
+        """
+        readDatasets(): Read one or more datasets from all of the files.
+
+        USAGE:   data = MultiHDF5().readDatasets(hdfdir,[required],[exist_if_missing],
+                                                 [columnar])
+
+        Inputs:
+               hdfdir : Path to dataset or group of datasets to read.
+               required : List of names of datasets to read. If required=None, will read
+                          all datasets. (Default = None).
+               exit_if_missing : Will raise error and exit if any of names in 'required'
+                                 are missing. (Default = True).
+               columnar : If reading HDF5 group, return a dictionary of contiguous
+                          arrays (one per dataset) instead of a structured array.
+                          (Default = False).
+
+        Outputs:
+               data : Numpy array of datasets (or dictionary of arrays if columnar=True),
+                      containing the rows from each file in turn.
+
+        Note: the row offsets of each file are computed from the dataset shapes,
+              so the output is allocated once and each file is read directly into
+              its rows. With processes > 1 the files are read by a pool of worker
+              processes (h5py cannot decompress in parallel threads) directly into
+              a shared memory block, which is then returned as the output. The
+              block is closed when the output (and any views of it) is collected.
+
+        """
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        path = normalizePath(hdfdir)
+        single = False
+        if path != "/":
+            parent,name = path.rsplit("/",1)
+            for members in self._members(parent or "/"):
+                if members is not None and name in members:
+                    single = members[name]["kind"] == "dataset"
+                    break
+        if single:
+            objs = [path.split("/")[-1]]
+            path = path[:-len(objs[0])]
+            columnar = True
+        elif required is not None:
+            objs = self.findMatchingDatasets(path,required,exit_if_missing=exit_if_missing)
+        else:
+            objs = self.lsDatasets(path)
+        offsets = self.rowOffsets(path,objs)
+        n = int(offsets[-1])
+        spec,nbytes = self._columnSpec(path,objs,offsets,columnar)
+        jobs = [(self.files[i],path,objs,spec,n,offsets[i],offsets[i+1]) \
+                    for i in range(len(self.files)) if offsets[i+1] > offsets[i]]
+        if self.processes is None or self.processes <= 1 or len(jobs) <= 1:
+            buffer = np.empty(nbytes,dtype=np.uint8)
+            for job in jobs:
+                _multiReadFile(buffer,job)
+        else:
+            import multiprocessing
+            import weakref
+            from multiprocessing import shared_memory
+            shm = shared_memory.SharedMemory(create=True,size=max(nbytes,1))
+            try:
+                with multiprocessing.Pool(min(self.processes,len(jobs))) as pool:
+                    for rows in pool.imap_unordered(_multiReadShared,[(shm.name,job) for job in jobs]):
+                        pass
+            except:
+                shm.close()
+                raise
+            finally:
+                # The name is no longer needed: the block persists while mapped
+                shm.unlink()
+            buffer = np.ndarray(nbytes,dtype=np.uint8,buffer=shm.buf)
+            weakref.finalize(buffer,_multiCloseShared,shm)
+        columns = _multiColumns(buffer,spec,n,objs)
+        if single:
+            return columns[objs[0]]
+        if columnar:
+            return columns
+        return np.ndarray(n,dtype=spec,buffer=buffer)
+
+
 def buildTestFile(filename):
     f = h5py.File(filename,'w')
     f.create_group("/Data/ExampleGroup")        
@@ -580,6 +1378,42 @@ class UnitTest(unittest.TestCase):
         print("\n")
         return
 
+    def testIndex(self):
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        print("UNIT TEST: HDF5: "+funcname)
+        print("Testing metadata index")
+        F = HDF5(self.tmpfile,'w')
+        F.mkGroup("/Data")
+        F.writeDataset("/Data","ExampleData1",np.arange(50,dtype=float))
+        index = F.index()
+        self.assertEqual(index["/Data"]["kind"],"group")
+        self.assertEqual(index["/Data/ExampleData1"]["shape"],(50,))
+        self.assertEqual(F.datasetSize("/Data/ExampleData1"),50)
+        F.appendDataset("/Data","ExampleData1",np.arange(10,dtype=float))
+        self.assertEqual(F.datasetSize("/Data/ExampleData1"),60)
+        F.fileObj["/Data/Link"] = h5py.SoftLink("/Data/ExampleData1")
+        self.assertTrue(F.datasetExists("/Data","Link"))
+        F.rmDataset("/Data","ExampleData1")
+        self.assertFalse(F.datasetExists("/Data","ExampleData1",exit_if_missing=False))
+        self.assertFalse("/Data/ExampleData1" in F.index())
+        F.writeDataset("/Other/Sub","ExampleData2",np.arange(5))
+        self.assertEqual(F.lsDatasets("/Other",recursive=True),["/Other/Sub/ExampleData2"])
+        self.assertEqual(F.index()["/Other/Sub/ExampleData2"]["size"],5)
+        F.rmGroup("/Other")
+        self.assertFalse("/Other" in F.index())
+        self.assertFalse(F.datasetExists("/Other/Sub","ExampleData2",exit_if_missing=False))
+        # Dataset names that also occur elsewhere in the path
+        F.writeDataset("/Data","a",np.arange(5))
+        self.assertEqual(F.datasetSize("/Data/a"),5)
+        self.assertTrue(np.array_equal(F.readDataset("/Data/a"),np.arange(5)))
+        self.assertTrue(np.array_equal(F.readDatasets("/Data",required=["a"])["a"],np.arange(5)))
+        self.assertTrue(np.array_equal(F.selectRows("/Data",[("a",">",2)]),[3,4]))
+        F.close()
+        os.remove(self.tmpfile)
+        print("TEST COMPLETE")
+        print("\n")
+        return
+
     def testReadDatasets(self):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
         print("UNIT TEST: HDF5: "+funcname)
@@ -604,6 +1438,118 @@ class UnitTest(unittest.TestCase):
         print("\n")        
         return
                 
+    def testReadGroupDatasets(self):
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        print("UNIT TEST: HDF5: "+funcname)
+        print("Testing reading datasets in a group")
+        F = HDF5(self.examplefile,'r')
+        data = F.readDatasets("/Data")
+        self.assertEqual(sorted(data.dtype.names),["ExampleFloatData","ExampleIntData"])
+        self.assertTrue(np.array_equal(data["ExampleFloatData"],np.arange(100,dtype=float)))
+        self.assertTrue(np.array_equal(data["ExampleIntData"],np.arange(100,dtype=int)))
+        data = F.readDatasets("/Data",required=["*Int*"],columnar=True)
+        self.assertEqual(list(data.keys()),["ExampleIntData"])
+        self.assertTrue(data["ExampleIntData"].flags["C_CONTIGUOUS"])
+        self.assertTrue(np.array_equal(data["ExampleIntData"],np.arange(100,dtype=int)))
+        out = np.zeros(100,dtype=[("a",int),("b",float)])
+        F.readColumn("/Data/ExampleFloatData",out["b"],chunksize=7)
+        self.assertTrue(np.array_equal(out["b"],np.arange(100,dtype=float)))
+        self.assertRaises(ValueError,F.readColumn,"/Data/ExampleFloatData",np.zeros(10))
+        self.assertEqual(F.datasetSize("/Data/ExampleGroup/ExampleIntData2"),10)
+        data = F.readDatasets("/Data/",recursive=True,required=["*Int*"],columnar=True)
+        self.assertEqual(sorted(data.keys()),["ExampleGroup/ExampleIntData2","ExampleIntData"])
+        self.assertTrue(np.array_equal(data["ExampleGroup/ExampleIntData2"],np.arange(10)))
+        data = F.readDatasets("/Data",recursive=True,required=["ExampleGroup/*"])
+        self.assertEqual(sorted(data.dtype.names),["ExampleGroup/ExampleFloatData2",\
+                                                       "ExampleGroup/ExampleIntData2"])
+        F.close()
+        print("TEST COMPLETE")
+        print("\n")
+        return
+
+    def testIterDatasets(self):
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        print("UNIT TEST: HDF5: "+funcname)
+        print("Testing iterating over datasets in blocks")
+        F = HDF5(self.examplefile,'r')
+        for readahead in [False,True]:
+            blocks = list(F.iterDatasets("/Data",blocksize=30,readahead=readahead))
+            self.assertEqual([len(block) for block in blocks],[30,30,30,10])
+            data = np.concatenate(blocks)
+            self.assertTrue(np.array_equal(data["ExampleFloatData"],np.arange(100,dtype=float)))
+            self.assertTrue(np.array_equal(data["ExampleIntData"],np.arange(100,dtype=int)))
+        blocks = list(F.iterDatasets("/Data",required=["*Int*"],blocksize=64,columnar=True))
+        self.assertEqual(list(blocks[1].keys()),["ExampleIntData"])
+        self.assertTrue(np.array_equal(blocks[1]["ExampleIntData"],np.arange(64,100)))
+        blocks = list(F.iterDatasets("/Data/ExampleGroup/ExampleFloatData2"))
+        self.assertTrue(np.array_equal(np.concatenate(blocks),np.arange(10,dtype=float)))
+        self.assertEqual(len(list(F.iterDatasets("/Data/ExampleGroup",blocksize=4))),3)
+        self.assertRaises(KeyError,list,F.iterDatasets("/Data/ExampleData"))
+        F.close()
+        print("TEST COMPLETE")
+        print("\n")
+        return
+
+    def testSelectRows(self):
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        print("UNIT TEST: HDF5: "+funcname)
+        print("Testing reading selected rows")
+        F = HDF5(self.examplefile,'r')
+        where = [("ExampleIntData",">=",20),("ExampleFloatData","<",75.0)]
+        self.assertTrue(np.array_equal(F.selectRows("/Data",where,blocksize=16),np.arange(20,75)))
+        data = F.readDatasets("/Data",where=where)
+        self.assertTrue(np.array_equal(data["ExampleIntData"],np.arange(20,75)))
+        self.assertTrue(np.array_equal(data["ExampleFloatData"],np.arange(20,75,dtype=float)))
+        rows = [99,3,4,5,50,3,-1]
+        data = F.readDatasets("/Data",rows=rows,columnar=True)
+        self.assertTrue(np.array_equal(data["ExampleIntData"],[99,3,4,5,50,3,99]))
+        data = F.readDatasets("/Data/ExampleFloatData",rows=rows,where=where)
+        self.assertTrue(np.array_equal(data,[50.0]))
+        self.assertTrue(np.array_equal(F.readRows("/Data/ExampleIntData",[1,2,3,10,12],blocksize=4),\
+                                           [1,2,3,10,12]))
+        data = F.readDatasets("/Data",where=[])
+        self.assertTrue(np.array_equal(data["ExampleIntData"],np.arange(100)))
+        self.assertTrue(np.array_equal(F.selectRows("/Data",[]),np.arange(100)))
+        self.assertRaises(ValueError,F.readDatasets,"/Data",where=[("ExampleIntData","~",1)])
+        self.assertRaises(ValueError,F.readRows,"/Data/ExampleIntData",[100])
+        F.close()
+        print("TEST COMPLETE")
+        print("\n")
+        return
+
+    def testMultiFile(self):
+        funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
+        print("UNIT TEST: HDF5: "+funcname)
+        print("Testing reading datasets split across files")
+        files = ["unitTestMulti"+str(i)+".hdf5" for i in range(3)]
+        for i,filename in enumerate(files):
+            F = HDF5(filename,'w')
+            F.mkGroup("/Data")
+            if i != 1:
+                F.writeDataset("/Data","ExampleIntData",np.arange(10*i,10*i+5+i))
+                F.writeDataset("/Data","ExampleFloatData",np.arange(10*i,10*i+5+i,dtype=float))
+            F.close()
+        ref = np.append(np.arange(0,5),np.arange(20,27))
+        for processes in [None,2]:
+            M = MultiHDF5("unitTestMulti*.hdf5",processes=processes)
+            self.assertEqual(list(M.rowOffsets("/Data",["ExampleIntData"])),[0,5,5,12])
+            data = M.readDatasets("/Data")
+            self.assertTrue(np.array_equal(data["ExampleIntData"],ref))
+            self.assertTrue(np.array_equal(data["ExampleFloatData"],ref.astype(float)))
+            data = M.readDatasets("/Data",required=["*Int*"],columnar=True)
+            self.assertEqual(list(data.keys()),["ExampleIntData"])
+            column = data["ExampleIntData"]
+            del data
+            self.assertTrue(np.array_equal(column,ref))
+            self.assertTrue(np.array_equal(M.readDatasets("/Data/ExampleFloatData"),ref.astype(float)))
+        self.assertEqual(M.datasetSize("/Data/ExampleIntData"),12)
+        self.assertRaises(KeyError,M.readDatasets,"/Data",required=["Missing"])
+        [os.remove(filename) for filename in files]
+        self.assertRaises(IOError,MultiHDF5,"unitTestMulti*.hdf5")
+        print("TEST COMPLETE")
+        print("\n")
+        return
+                
     def testReadAttributes(self):
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name
         print("UNIT TEST: HDF5: "+funcname)
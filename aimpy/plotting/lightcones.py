@@ -4,14 +4,7 @@ import sys,os,glob,fnmatch
 import numpy as np
 from .utils import *
 from ..constants import Pi
-
-from matplotlib.projections import PolarAxes
-from matplotlib.transforms import Affine2D
-import mpl_toolkits.axisartist.floating_axes as floating_axes
-import  mpl_toolkits.axisartist.angle_helper as angle_helper
-from matplotlib.projections import PolarAxes
 import matplotlib.ticker 
-from mpl_toolkits.axisartist.grid_finder import FixedLocator, MaxNLocator, DictFormatter
 
 
 class angularGeometry(object):
@@ -135,6 +128,12 @@ class conePlot(object):
                      angularUnits="degrees",angularSigFig=2,angularLabel=None,\
                      radialUnits=None,radialSigFig=2,radialLabel=None,\
                      subplot=111,rotate=0.0,gridlines=True,verbose=False):
+        # mpl_toolkits.axisartist is slow to import, so only import it
+        # when constructing a plot
+        from matplotlib.projections import PolarAxes
+        from matplotlib.transforms import Affine2D
+        import mpl_toolkits.axisartist.floating_axes as floating_axes
+        from mpl_toolkits.axisartist.grid_finder import FixedLocator, DictFormatter
         classname = self.__class__.__name__
         funcname = self.__class__.__name__+"."+sys._getframe().f_code.co_name        
         # Store figure
@@ -4,7 +4,6 @@ import sys,fnmatch
 import math,re
 import numpy as np
 import matplotlib
-from scipy.stats import *
 
 def X11_forwarding():
     import os
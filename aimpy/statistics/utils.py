@@ -3,14 +3,24 @@
 import re
 import fnmatch
 import math
-from scipy.stats import *
 import numpy as np
 
+
+def __getattr__(name):
+    # scipy.stats is slow to import, so its names (previously star-imported
+    # here) are only looked up when first requested.
+    import scipy.stats
+    if name.startswith("_") or not hasattr(scipy.stats,name):
+        raise AttributeError("module '"+__name__+"' has no attribute '"+name+"'")
+    return getattr(scipy.stats,name)
+
+
 def mad(data,axis=None):
     return np.median(np.absolute(data-np.median(data,axis)),axis)
 
 
 def binstats(X,Y,Xbins,statistic="median",weights=None,mask=None):
+    from scipy.stats import binned_statistic,mode
     if weights is None:
         weights = np.ones_like(X)
     if mask is None:
@@ -63,6 +73,7 @@ class statisticalFunctions(object):
         return np.average(x,weights=self.weights)
 
     def mode(self,x):
+        from scipy.stats import mode
         return mode(x)[0][0]
 
     def percentile(self,x):
@@ -104,6 +115,7 @@ def binstats2D(X,Y,Xbins,Ybins=None,Z=None,statistic="median",weights=None):
                                                                                                                                                                                                                            
     NB 'avg' is weighted average                                                                                                                                                                                            
     """
+    from scipy.stats import binned_statistic_2d
     # Set X and Y bins
     if Ybins is None:
         Ybins = np.copy(Xbins)
@@ -144,6 +156,7 @@ def binstats2D_old(X,Y,Xbins,Ybins=None,Z=None,statistic="median",weights=None):
                                                                                                                                                                                                                             
     NB 'avg' is weighted average                                                                                                                                                                                            
     """
+    from scipy.stats import binned_statistic_2d,mode
     if statistic is None:
         statistic = "count"
     if Ybins is None:
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+"""
+bench_cosmology.py: Speed, memory and accuracy benchmarks for aimpy.cosmology.
+
+USAGE: python benchmarks/bench_cosmology.py [--sizes N ...] [--repeat N]
+                                            [--baseline FILE] [--save]
+                                            [--time-tolerance X]
+                                            [--memory-tolerance X]
+                                            [--accuracy-tolerance X]
+
+Measures, for several cosmology configurations:
+  - construction time (including building the distance tables),
+  - time per element and peak memory per element of comoving_distance(),
+    redshift_at_distance(), dVdz() and age_of_universe() for each array
+    size (default 1e3-1e6; pass e.g. --sizes 1e7 1e8 for large runs),
+  - maximum relative error against high-precision quadrature.
+
+Results are compared against the stored baseline (baseline_cosmology.json
+next to this script) and the script exits with status 1 if anything is
+slower, uses more memory or is less accurate than the baseline allows.
+Timings depend on the machine, so re-save the baseline (--save) when
+benchmarking on a new machine before making changes.
+
+"""
+import sys,os,time,json,argparse,tracemalloc
+import numpy as np
+from scipy.integrate import quad
+from aimpy.cosmology import Cosmology
+
+
+CONFIGS = {"table":dict(backend="table"),
+           "adaptive":dict(backend="table",grid="adaptive"),
+           "analytic":dict(backend="analytic"),
+           "open":dict(omega0=0.3,lambda0=0.5)}
+
+FUNCTIONS = ["comoving_distance","redshift_at_distance","dVdz","age_of_universe"]
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"baseline_cosmology.json")
+
+
+def buildCosmology(name):
+    return Cosmology(cache=False,**CONFIGS[name])
+
+
+def benchmarkInputs(COSMO,func,n,rng):
+    z = rng.uniform(0.0,10.0,n)
+    if func == "redshift_at_distance":
+        return COSMO.comoving_distance(z)
+    return z
+
+
+def timeConstruction(name,repeat):
+    best = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        COSMO = buildCosmology(name)
+        COSMO.comoving_distance(1.0)
+        COSMO.age_of_universe(1.0)
+        best = min(best,time.perf_counter()-start)
+    return best
+
+
+def timeFunction(COSMO,func,x,repeat):
+    method = getattr(COSMO,func)
+    method(x[:10])
+    best = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        method(x)
+        best = min(best,time.perf_counter()-start)
+    tracemalloc.start()
+    method(x)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best,peak
+
+
+def referenceValues(COSMO,func,z):
+    distance = lambda zz: COSMO.HubbleDistance*quad(lambda x: 1.0/COSMO.E(x),0.0,zz,epsabs=0.0,epsrel=1.0e-13)[0]
+    if func in ["comoving_distance","redshift_at_distance"]:
+        return np.array([distance(zz) for zz in z])
+    if func == "dVdz":
+        DM = np.array([distance(zz) for zz in z])
+        if COSMO.omegak > 0.0:
+            k = np.sqrt(COSMO.omegak)/COSMO.HubbleDistance
+            DM = np.sinh(k*DM)/k
+        elif COSMO.omegak < 0.0:
+            k = np.sqrt(-COSMO.omegak)/COSMO.HubbleDistance
+            DM = np.sin(k*DM)/k
+        return 4.0*np.pi*COSMO.HubbleDistance*DM**2/COSMO.E(z)
+    if func == "age_of_universe":
+        integrand = lambda x: 1.0/((1.0+x)*COSMO.E(x))
+        return np.array([COSMO.HubbleTime*quad(integrand,zz,np.inf,epsabs=0.0,epsrel=1.0e-13)[0] for zz in z])
+    raise KeyError("referenceValues(): no reference for "+func+".")
+
+
+def accuracy(COSMO,func):
+    z = np.logspace(-3.0,np.log10(20.0),100)
+    ref = referenceValues(COSMO,func,z)
+    if func == "redshift_at_distance":
+        return float(np.max(np.fabs(COSMO.redshift_at_distance(ref)/z-1.0)))
+    return float(np.max(np.fabs(getattr(COSMO,func)(z)/ref-1.0)))
+
+
+def runBenchmarks(sizes,repeat):
+    rng = np.random.default_rng(12345)
+    results = {}
+    for name in CONFIGS.keys():
+        results[name+"/construction/time"] = timeConstruction(name,repeat)
+        COSMO = buildCosmology(name)
+        for func in FUNCTIONS:
+            results[name+"/"+func+"/accuracy"] = accuracy(COSMO,func)
+            for n in sizes:
+                x = benchmarkInputs(COSMO,func,n,rng)
+                elapsed,peak = timeFunction(COSMO,func,x,repeat)
+                results[name+"/"+func+"/"+str(n)+"/time"] = elapsed/n
+                results[name+"/"+func+"/"+str(n)+"/memory"] = peak/float(n)
+            print(name+"/"+func+": done",file=sys.stderr)
+    return results
+
+
+def compareResults(results,baseline,timeTolerance,memoryTolerance,accuracyTolerance):
+    regressions = []
+    print("%-50s %12s %12s %8s" % ("benchmark","baseline","current","ratio"))
+    for key in sorted(results.keys()):
+        current = results[key]
+        if key not in baseline:
+            print("%-50s %12s %12.4g %8s" % (key,"-",current,"-"))
+            continue
+        reference = baseline[key]
+        if key.endswith("/accuracy"):
+            # Errors at the level of machine precision are not regressions
+            reference = max(reference,1.0e-14)
+            tolerance = accuracyTolerance
+        elif key.endswith("/memory"):
+            # Allow for small fixed-size allocations at small array sizes
+            reference = max(reference,1.0)
+            tolerance = memoryTolerance
+        else:
+            tolerance = timeTolerance
+        ratio = current/reference
+        flag = ""
+        if ratio > tolerance:
+            flag = " REGRESSION"
+            regressions.append(key)
+        print("%-50s %12.4g %12.4g %8.2f%s" % (key,baseline[key],current,ratio,flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for aimpy.cosmology.")
+    parser.add_argument("--sizes",nargs="+",type=float,default=[1.0e3,1.0e4,1.0e5,1.0e6],\
+                            help="array sizes at which to time each function")
+    parser.add_argument("--repeat",type=int,default=3,help="number of timings (best is kept)")
+    parser.add_argument("--baseline",default=BASELINE,help="baseline JSON file")
+    parser.add_argument("--save",action="store_true",help="store results as the new baseline")
+    parser.add_argument("--time-tolerance",type=float,default=1.5,\
+                            help="allowed ratio of time to baseline time")
+    parser.add_argument("--memory-tolerance",type=float,default=1.5,\
+                            help="allowed ratio of peak memory to baseline memory")
+    parser.add_argument("--accuracy-tolerance",type=float,default=2.0,\
+                            help="allowed ratio of error to baseline error")
+    args = parser.parse_args()
+    results = runBenchmarks([int(n) for n in args.sizes],args.repeat)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline,"w") as f:
+            json.dump(baseline,f,indent=1,sort_keys=True)
+        print("Baseline written to "+args.baseline)
+        return 0
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compareResults(results,baseline,args.time_tolerance,\
+                                     args.memory_tolerance,args.accuracy_tolerance)
+    if len(regressions) > 0:
+        print(str(len(regressions))+" regression(s) found.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#! /usr/bin/env python
+
+import os
+import numpy as np
+import pickle
+import tempfile
+import unittest
+from scipy.integrate import quad
+from aimpy.cosmology import Cosmology,CosmologyGrid,DistanceTableCache,adjustHubble,redshiftSpace
+from aimpy import cosmology
+
+
+# Flat, open, closed and radiation models, with each table grid/backend
+MODELS = [dict(omega0=0.25,lambda0=0.75),
+          dict(omega0=0.25,lambda0=0.75,backend="table"),
+          dict(omega0=0.25,lambda0=0.75,backend="table",grid="adaptive"),
+          dict(omega0=0.3,lambda0=0.5),
+          dict(omega0=0.5,lambda0=0.7),
+          dict(omega0=0.3,lambda0=0.7,radiation=True)]
+
+REDSHIFTS = np.array([0.05,0.3,1.0,2.5,6.0,15.0])
+
+
+def referenceDistance(COSMO,z):
+    integral = [quad(lambda x: 1.0/COSMO.E(x),0.0,zz,epsabs=0.0,epsrel=1.0e-13)[0] for zz in z]
+    return COSMO.HubbleDistance*np.array(integral)
+
+
+def referenceVolume(COSMO,z,order=64):
+    x,w = np.polynomial.legendre.leggauss(order)
+    V = []
+    for zz in z:
+        nodes = 0.5*zz*(x+1.0)
+        DM = referenceDistance(COSMO,nodes)
+        if COSMO.omegak > 0.0:
+            k = np.sqrt(COSMO.omegak)/COSMO.HubbleDistance
+            DM = np.sinh(k*DM)/k
+        elif COSMO.omegak < 0.0:
+            k = np.sqrt(-COSMO.omegak)/COSMO.HubbleDistance
+            DM = np.sin(k*DM)/k
+        dVdz = 4.0*np.pi*COSMO.HubbleDistance*DM**2/COSMO.E(nodes)
+        V.append(0.5*zz*np.sum(w*dVdz))
+    return np.array(V)
+
+
+def referenceLookback(COSMO,z):
+    integrand = lambda x: 1.0/((1.0+x)*COSMO.E(x))
+    integral = [quad(integrand,0.0,zz,epsabs=0.0,epsrel=1.0e-13)[0] for zz in z]
+    return COSMO.HubbleTime*np.array(integral)
+
+
+class TestCosmology(unittest.TestCase):
+
+
+    def test_comoving_distance(self):
+        for kwargs in MODELS:
+            COSMO = Cosmology(**kwargs)
+            ref = referenceDistance(COSMO,REDSHIFTS)
+            np.testing.assert_allclose(COSMO.comoving_distance(REDSHIFTS),ref,rtol=1.0e-6)
+            self.assertEqual(COSMO.comoving_distance(0.0),0.0)
+        return
+
+    def test_redshift_at_distance(self):
+        for kwargs in MODELS:
+            COSMO = Cosmology(**kwargs)
+            r = referenceDistance(COSMO,REDSHIFTS)
+            np.testing.assert_allclose(COSMO.redshift_at_distance(r),REDSHIFTS,rtol=1.0e-6)
+            np.testing.assert_allclose(COSMO.redshift_at_distance(r,refine=True),\
+                                           REDSHIFTS,rtol=1.0e-12)
+        return
+
+    def test_lookback_time(self):
+        for kwargs in MODELS:
+            COSMO = Cosmology(**kwargs)
+            ref = referenceLookback(COSMO,REDSHIFTS)
+            np.testing.assert_allclose(COSMO.lookback_time(REDSHIFTS),ref,rtol=1.0e-6)
+            age = COSMO.age_of_universe(0.0)
+            np.testing.assert_allclose(COSMO.age_of_universe(REDSHIFTS),age-ref,rtol=1.0e-5)
+            np.testing.assert_allclose(COSMO.redshift_at_age(age-ref),REDSHIFTS,rtol=1.0e-5)
+        return
+
+    def test_volume(self):
+        for kwargs in MODELS:
+            COSMO = Cosmology(**kwargs)
+            V = referenceVolume(COSMO,REDSHIFTS)
+            np.testing.assert_allclose(COSMO.comoving_volume(REDSHIFTS),V,rtol=5.0e-5)
+            np.testing.assert_allclose(COSMO.redshift_at_volume(V),REDSHIFTS,rtol=5.0e-5)
+            DA = COSMO.angular_diameter_distance(REDSHIFTS)
+            ref = 4.0*np.pi*COSMO.HubbleDistance*(DA*(1.0+REDSHIFTS))**2/COSMO.E(REDSHIFTS)
+            np.testing.assert_allclose(COSMO.dVdz(REDSHIFTS),ref,rtol=5.0e-5)
+        return
+
+    def test_random_redshifts(self):
+        COSMO = Cosmology(backend="table")
+        z = COSMO.random_redshifts(100000,zmin=0.5,zmax=2.0,rng=42)
+        self.assertEqual(len(z),100000)
+        self.assertTrue(np.all((z >= 0.5) & (z <= 2.0)))
+        np.testing.assert_array_equal(COSMO.random_redshifts(10,0.5,2.0,rng=42),z[:10])
+        # Redshifts are uniform in comoving volume
+        V = COSMO.comoving_volume(z)
+        V0,V1 = COSMO.comoving_volume(np.array([0.5,2.0]))
+        counts = np.histogram(V,bins=10,range=(V0,V1))[0]
+        self.assertLess(np.max(np.fabs(counts-10000.0)),5.0*np.sqrt(10000.0))
+        return
+
+    def test_growth(self):
+        # Heath (1977) integral, exact for models without radiation
+        for kwargs in MODELS[:5]:
+            COSMO = Cosmology(**kwargs)
+            integrand = lambda a: 1.0/(a*COSMO.E(1.0/a-1.0))**3
+            D = [COSMO.E(zz)*quad(integrand,0.0,1.0/(1.0+zz),epsabs=0.0,epsrel=1.0e-12)[0] \
+                     for zz in np.append(0.0,REDSHIFTS)]
+            np.testing.assert_allclose(COSMO.growth_factor(REDSHIFTS),D[1:]/D[0],rtol=1.0e-6)
+            self.assertAlmostEqual(COSMO.growth_factor(0.0),1.0)
+            onepz = 1.0 + REDSHIFTS
+            f = (onepz**2/np.array(D[1:]) - COSMO.omegak*onepz**2 - \
+                     1.5*COSMO.omega0*onepz**3)/COSMO.E(REDSHIFTS)**2
+            np.testing.assert_allclose(COSMO.growth_rate(REDSHIFTS),f,rtol=1.0e-6)
+        return
+
+    def test_E(self):
+        z = np.linspace(0.0,20.0,1001)
+        for kwargs in MODELS[3:]:
+            COSMO = Cosmology(**kwargs)
+            x = 1.0 + z
+            ref = np.sqrt(COSMO.omegar*x**4 + COSMO.omega0*x**3 + COSMO.omegak*x**2 + COSMO.lambda0)
+            for threshold in [Cosmology.numexpr_threshold,1]:
+                # (threshold=1 uses numexpr, if it is installed)
+                COSMO.numexpr_threshold = threshold
+                np.testing.assert_allclose(COSMO.E(z),ref,rtol=1.0e-14)
+                out = np.empty_like(z)
+                self.assertIs(COSMO.E(z,out=out),out)
+                np.testing.assert_allclose(out,ref,rtol=1.0e-14)
+                E32 = COSMO.E(z,dtype=np.float32)
+                self.assertEqual(E32.dtype,np.float32)
+                np.testing.assert_allclose(E32,ref,rtol=1.0e-6)
+                out = np.empty(z.shape,dtype=np.float32)
+                np.testing.assert_allclose(COSMO.H(z,out=out),COSMO.H0*ref,rtol=1.0e-6)
+                np.testing.assert_allclose(COSMO.f(z),COSMO.HubbleDistance/ref,rtol=1.0e-14)
+            self.assertIsInstance(COSMO.E(1.0),float)
+        return
+
+    def test_grid(self):
+        omega0 = np.array([0.25,0.3,0.5,0.3])
+        lambda0 = np.array([0.75,0.5,0.7,0.7])
+        z = np.array([[0.1,1.0],[3.0,15.0]])
+        GRID = CosmologyGrid(omega0,lambda0,radiation=True,chunksize=3)
+        self.assertEqual(len(GRID),4)
+        DM = GRID.comoving_transverse_distance(z)
+        self.assertEqual(DM.shape,(4,2,2))
+        dVdz = GRID.dVdz(z)
+        for i in range(len(GRID)):
+            COSMO = Cosmology(omega0=omega0[i],lambda0=lambda0[i],radiation=True)
+            ref = referenceDistance(COSMO,z.ravel()).reshape(z.shape)
+            np.testing.assert_allclose(GRID.comoving_distance(z)[i],ref,rtol=1.0e-10)
+            np.testing.assert_allclose(DM[i],COSMO.comoving_transverse_distance(z),rtol=1.0e-6)
+            np.testing.assert_allclose(dVdz[i],COSMO.dVdz(z),rtol=1.0e-5)
+        self.assertEqual(GRID.comoving_distance([]).shape,(4,0))
+        self.assertEqual(GRID.luminosity_distance(np.zeros((0,3))).shape,(4,0,3))
+        self.assertRaises(ValueError,GRID.comoving_distance,[-0.5,1.0])
+        self.assertRaises(ValueError,GRID.comoving_distance,np.nan)
+        return
+
+    def test_distances(self):
+        COSMO = Cosmology(backend="table")
+        DM,DA,DL,BCDM = COSMO.distances(REDSHIFTS)
+        np.testing.assert_allclose(DA,COSMO.angular_diameter_distance(REDSHIFTS),rtol=1.0e-12)
+        np.testing.assert_allclose(DL,COSMO.luminosity_distance(REDSHIFTS),rtol=1.0e-12)
+        np.testing.assert_allclose(BCDM,COSMO.band_corrected_distance_modulus(REDSHIFTS),rtol=1.0e-12)
+        z = np.reshape(REDSHIFTS,(2,3))
+        out = tuple([np.zeros((2,3)) for i in range(4)])
+        self.assertIs(COSMO.distances(z,out=out),out)
+        np.testing.assert_allclose(out[1],COSMO.angular_diameter_distance(z),rtol=1.0e-12)
+        self.assertRaises(ValueError,COSMO.distances,z,out=[np.zeros((3,2)).T]*4)
+        self.assertRaises(ValueError,COSMO.distances,z,out=[np.zeros(6)]*4)
+        self.assertRaises(ValueError,COSMO.distances,z,out=out[:3])
+        return
+
+    def test_out_of_range(self):
+        COSMO = Cosmology(backend="table",zmax=2.0)
+        ref = referenceDistance(COSMO,[10.0])
+        np.testing.assert_allclose(COSMO.comoving_distance(10.0),ref,rtol=1.0e-6)
+        COSMO = Cosmology(backend="table",zmax=2.0,out_of_range="raise")
+        self.assertRaises(ValueError,COSMO.comoving_distance,10.0)
+        COSMO = Cosmology(backend="table",zmax=2.0,out_of_range="nan")
+        self.assertTrue(np.isnan(COSMO.comoving_distance(10.0)))
+        return
+
+    def test_non_finite(self):
+        z = np.array([1.0,np.nan,np.inf])
+        for kwargs in MODELS:
+            COSMO = Cosmology(cache=False,**kwargs)
+            for func in [COSMO.comoving_distance,COSMO.lookback_time,COSMO.age_of_universe,\
+                             COSMO.dVdz,COSMO.comoving_volume,COSMO.growth_factor]:
+                result = func(z)
+                self.assertTrue(np.isfinite(result[0]))
+                self.assertTrue(np.all(np.isnan(result[1:])))
+        for policy in ["extend","clip","nan","raise"]:
+            for kwargs in MODELS[:3]:
+                COSMO = Cosmology(out_of_range=policy,**kwargs)
+                r = np.array([100.0,np.nan])
+                for refine in [False,True]:
+                    result = COSMO.redshift_at_distance(r,refine=refine)
+                    np.testing.assert_allclose(COSMO.comoving_distance(result[0]),100.0,rtol=1.0e-5)
+                    self.assertTrue(np.isnan(result[1]))
+                self.assertTrue(np.isnan(COSMO.redshift_at_distance(np.nan)))
+        # Tables are not extended beyond zlimit
+        COSMO = Cosmology(backend="table",cache=False)
+        self.assertTrue(np.isnan(COSMO.comoving_distance(1.0e5)))
+        self.assertLessEqual(COSMO._redshift[-1],COSMO.zlimit+COSMO._dz)
+        return
+
+    def test_realspace(self):
+        COSMO = Cosmology(backend="table")
+        ra = np.array([0.0,45.0,190.0,359.0])
+        dec = np.array([-80.0,-10.0,0.0,60.0])
+        z = np.array([0.1,0.5,1.0,3.0])
+        pos = COSMO.realspace(ra,dec,z,out=np.empty((4,3),dtype=np.float32),chunksize=3)
+        XX,YY,ZZ = COSMO.realspace(ra,dec,z)
+        np.testing.assert_allclose(pos,np.column_stack((XX,YY,ZZ)),rtol=1.0e-6)
+        np.testing.assert_allclose(np.sqrt(XX**2+YY**2+ZZ**2),COSMO.comoving_distance(z))
+        RA,DEC,REDSHIFT = COSMO.skyspace(XX,YY,ZZ,refine=True)
+        np.testing.assert_allclose(RA,ra,atol=1.0e-10)
+        np.testing.assert_allclose(DEC,dec,atol=1.0e-10)
+        np.testing.assert_allclose(REDSHIFT,z,rtol=1.0e-12)
+        sky = np.zeros((4,3))
+        COSMO.skyspace(XX,YY,ZZ,out=(sky[:,0],sky[:,1],sky[:,2]),refine=True)
+        np.testing.assert_allclose(sky[:,2],z,rtol=1.0e-12)
+        self.assertRaises(ValueError,COSMO.skyspace,XX,YY,ZZ,out=[np.zeros((1,4)).T]*3)
+        self.assertRaises(ValueError,COSMO.skyspace,XX.reshape(2,2),YY.reshape(2,2),ZZ.reshape(2,2),\
+                              out=[np.zeros((2,2)).T]*3)
+        return
+
+    def test_redshift_space(self):
+        COSMO = Cosmology(backend="table")
+        rng = np.random.default_rng(1)
+        pos = rng.uniform(-500.0,500.0,(1000,3))
+        vel = rng.normal(0.0,300.0,(1000,3))
+        rs,zobs = redshiftSpace(pos,vel,COSMO,chunksize=300)
+        r = np.sqrt(np.sum(pos**2,axis=1))
+        z = COSMO.redshift_at_distance(r)
+        vlos = np.sum(pos*vel,axis=1)/r
+        np.testing.assert_allclose(zobs,z+vlos*(1.0+z)/2.99792458e5,rtol=1.0e-12)
+        np.testing.assert_allclose(np.sqrt(np.sum(rs**2,axis=1)),COSMO.comoving_distance(zobs),rtol=1.0e-10)
+        np.testing.assert_allclose(rs/np.sqrt(np.sum(rs**2,axis=1))[:,np.newaxis],pos/r[:,np.newaxis],\
+                                       rtol=1.0e-10)
+        # No peculiar velocities leaves positions unchanged
+        rs0,zobs0 = redshiftSpace(pos,np.zeros_like(vel),COSMO)
+        np.testing.assert_allclose(rs0,pos,rtol=5.0e-5)
+        np.testing.assert_allclose(zobs0,z,rtol=1.0e-12)
+        # Worker processes give the same result
+        out = np.empty((1000,3),dtype=np.float32)
+        rsp,zobsp = redshiftSpace(pos,vel,COSMO,out=out,chunksize=300,processes=2)
+        self.assertIs(rsp,out)
+        np.testing.assert_allclose(rsp,rs,rtol=1.0e-6)
+        np.testing.assert_array_equal(zobsp,zobs)
+        self.assertRaises(ValueError,redshiftSpace,pos,vel[:10],COSMO)
+        return
+
+    def test_halos(self):
+        COSMO = Cosmology(omega0=0.3,lambda0=0.7)
+        boxSize = np.array([250.0,500.0,1000.0])
+        mp = COSMO.particleMass(boxSize,512)
+        np.testing.assert_allclose(mp[1],COSMO.particleMass(500.0,512))
+        np.testing.assert_allclose(COSMO.boxSize(mp,512),boxSize)
+        np.testing.assert_allclose(COSMO.particlesPerSide(boxSize,mp),512.0)
+        self.assertAlmostEqual(COSMO.overdensity(0.0,"vir"),18.0*np.pi**2-82.0*0.7-39.0*0.49,places=4)
+        self.assertAlmostEqual(COSMO.overdensity(0.0,"200m"),60.0)
+        mass = np.array([1.0e12,1.0e14])
+        HALOS = COSMO.halo_catalog(mass,z=[0.0,1.0],particleMass=1.0e9)
+        rho = 200.0*COSMO.criticalDensity*COSMO.E(np.array([0.0,1.0]))**2
+        np.testing.assert_allclose(4.0*np.pi*rho*HALOS["radius"]**3/3.0,mass)
+        np.testing.assert_array_equal(HALOS["particles"],[1000,100000])
+        self.assertTrue(np.issubdtype(HALOS["particles"].dtype,np.integer))
+        self.assertEqual(COSMO.halo_catalog(1.6264e11,particleMass=1.0e9)["particles"],163)
+        self.assertNotIn("particles",COSMO.halo_catalog(mass).dtype.names)
+        np.testing.assert_allclose(HALOS["vcirc"],np.sqrt(4.3009e-9*mass/HALOS["radius"]),rtol=1.0e-3)
+        self.assertRaises(ValueError,COSMO.overdensity,0.0,"200x")
+        return
+
+    def test_table_cache(self):
+        cachedir = tempfile.mkdtemp()
+        other = os.path.join(cachedir,"other.npy")
+        np.save(other,np.zeros(3))
+        cache = cosmology.tableCache
+        try:
+            cosmology.tableCache = DistanceTableCache(cachedir=cachedir)
+            COSMO = Cosmology(backend="table")
+            dist = COSMO.comoving_distance(REDSHIFTS)
+            self.assertEqual(len(cosmology.tableCache),1)
+            # A new cache reads the tables back from disk
+            cosmology.tableCache = DistanceTableCache(cachedir=cachedir)
+            COPY = Cosmology(backend="table")
+            np.testing.assert_array_equal(COPY.comoving_distance(REDSHIFTS),dist)
+            self.assertFalse(COPY._r_comoving.flags["WRITEABLE"])
+            cosmology.tableCache.clear(disk=True)
+            self.assertEqual(os.listdir(cachedir),["other.npy"])
+        finally:
+            cosmology.tableCache = cache
+        os.remove(other)
+        os.rmdir(cachedir)
+        return
+
+    def test_pickle(self):
+        COSMO = Cosmology(backend="table")
+        dist = COSMO.comoving_distance(REDSHIFTS)
+        COPY = pickle.loads(pickle.dumps(COSMO))
+        np.testing.assert_array_equal(COPY.comoving_distance(REDSHIFTS),dist)
+        COPY = Cosmology.deserialize(COSMO.serialize())
+        np.testing.assert_array_equal(COPY.comoving_distance(REDSHIFTS),dist)
+        self.assertLess(len(pickle.dumps(Cosmology())),10000)
+        # The inverse table is rebuilt on demand after unpickling
+        COSMO = Cosmology()
+        z = COSMO.redshift_at_distance(1000.0)
+        COPY = pickle.loads(pickle.dumps(COSMO))
+        self.assertIsNone(COPY._inverse_redshift)
+        self.assertEqual(COPY.redshift_at_distance(1000.0),z)
+        return
+
+    def test_share_tables(self):
+        COSMO = Cosmology(backend="table")
+        dist = COSMO.comoving_distance(REDSHIFTS)
+        handle = COSMO.share_tables()
+        WORKER = Cosmology.from_shared_tables(pickle.loads(pickle.dumps(handle)))
+        np.testing.assert_array_equal(WORKER.comoving_distance(REDSHIFTS),dist)
+        self.assertEqual(WORKER.share_tables()["tables"],handle["tables"])
+        # Releasing a worker copy leaves the owner's blocks in place
+        WORKER.release_shared_tables()
+        np.testing.assert_array_equal(WORKER.comoving_distance(REDSHIFTS),dist)
+        WORKER = Cosmology.from_shared_tables(handle)
+        np.testing.assert_array_equal(WORKER.comoving_distance(REDSHIFTS),dist)
+        WORKER.release_shared_tables()
+        COSMO.release_shared_tables()
+        self.assertRaises(FileNotFoundError,Cosmology.from_shared_tables,handle)
+        return
+
+    def test_adjustHubble(self):
+        self.assertAlmostEqual(adjustHubble(1.0,0.7,1.0,"distance"),0.7)
+        self.assertAlmostEqual(adjustHubble(1.0,0.7,1.0,"volume"),0.343)
+        self.assertAlmostEqual(adjustHubble(1.0,0.7,1.0,"luminosity"),1.0/0.49)
+        self.assertAlmostEqual(adjustHubble(0.0,0.7,1.0,"magnitude"),5.0*np.log10(0.7))
+        DATA = np.ones(3,dtype=[("mass",float),("mag",float),("id",int)])
+        adjustHubble(DATA,0.7,1.0,{"mass":"mass","mag":"magnitude"})
+        np.testing.assert_allclose(DATA["mass"],0.7)
+        np.testing.assert_allclose(DATA["mag"],1.0+5.0*np.log10(0.7))
+        np.testing.assert_array_equal(DATA["id"],1)
+        self.assertRaises(ValueError,adjustHubble,1.0,0.7,1.0,"unknown")
+        self.assertRaises(ValueError,adjustHubble,DATA,0.7,1.0,{"id":"mass"})
+        np.testing.assert_array_equal(DATA["id"],1)
+        return
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+
+import os,sys
+import subprocess
+import unittest
+
+
+# Maximum cumulative cost of 'import aimpy.cosmology' (in microseconds).
+# This is mostly numpy; importing scipy as well costs several hundred ms.
+IMPORT_TIME_LIMIT = 250000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def importTime(module):
+    """
+    importTime(): Return the cumulative import time (in microseconds)
+                  reported by 'python -X importtime' for module, and
+                  the names of all modules imported.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT]+[env[key] for key in ["PYTHONPATH"] if key in env])
+    proc = subprocess.run([sys.executable,"-X","importtime","-c","import "+module],\
+                              env=env,stderr=subprocess.PIPE,universal_newlines=True,check=True)
+    cumulative = None
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if not fields[1].isdigit():
+            continue
+        modules.append(fields[2])
+        if fields[2] == module:
+            cumulative = int(fields[1])
+    return cumulative,modules
+
+
+class TestImportTime(unittest.TestCase):
+
+
+    def test_cosmology_import(self):
+        # Take the best of a few runs, as the first may compile byte code
+        times = []
+        for i in range(3):
+            cumulative,modules = importTime("aimpy.cosmology")
+            times.append(cumulative)
+        scipy = [name for name in modules if name == "scipy" or name.startswith("scipy.")]
+        self.assertEqual(scipy,[])
+        self.assertLess(min(times),IMPORT_TIME_LIMIT)
+        return
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()